@@ -1,35 +1,160 @@
-import cv2
-from deepface import DeepFace
-import av
-import time
-from streamlit_webrtc import VideoProcessorBase
-
-class EmotionProcessor(VideoProcessorBase):
-    def __init__(self):
-        super().__init__()
-        self.emotion_log = []
-        self.last_update = time.time()
-
-    def recv(self, frame: av.VideoFrame) -> av.VideoFrame:
-        img = frame.to_ndarray(format="bgr24")
-        
-        # Perform emotion analysis
-        try:
-            analysis = DeepFace.analyze(img, actions=['emotion'], enforce_detection=False)
-            emotion = analysis[0]['dominant_emotion']
-            
-            # Update emotion log every second
-            if time.time() - self.last_update >= 1:
-                self.emotion_log.append((emotion, time.strftime("%H:%M:%S")))
-                self.last_update = time.time()
-            
-            # Display emotion on screen
-            cv2.putText(img, f"Emotion: {emotion}", (20, 50),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-            
-        except Exception as e:
-            print(f"Error in analysis: {e}")
-            cv2.putText(img, "No face detected", (20, 50),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-        
-        return av.VideoFrame.from_ndarray(img, format="bgr24")
+import os
+import cv2
+import av
+import time
+import threading
+from streamlit_webrtc import VideoProcessorBase
+import emotion_service
+from engagement_log import RingLog
+import warmup
+from governor import FrameGovernor, GOVERNOR_TARGET_MS
+from metrics import VIDEO_FRAME_SECONDS, VIDEO_STAGE_SECONDS
+
+# DeepFace runs in a background worker fed by a one-slot "latest frame" buffer,
+# so recv never waits on the model: frames that arrive while an analysis is
+# running replace each other and only the newest one is analysed.
+# EMOTION_ANALYSIS_FPS caps how often the model runs, EMOTION_DISPLAY_FPS is
+# the frame rate requested from the camera.
+EMOTION_ANALYSIS_FPS = float(os.environ.get("EMOTION_ANALYSIS_FPS", "2"))
+EMOTION_DISPLAY_FPS = float(os.environ.get("EMOTION_DISPLAY_FPS", "30"))
+
+
+class EmotionWorker:
+    # Background DeepFace analysis of the most recently submitted image.
+    # detector_backend="skip" analyses the image as a face crop without running
+    # DeepFace's own face detector.
+    def __init__(self, analysis_fps=EMOTION_ANALYSIS_FPS, detector_backend="opencv", governor=None):
+        # governor, if given, is told how long each analysis took
+        self.governor = governor
+        self.emotion_log = RingLog(emotion_service.EMOTION_LABELS)
+        self.last_update = time.time()
+        self.emotion = None
+        self.max_analysis_fps = analysis_fps
+        self.detector_backend = detector_backend
+
+        # measured rate, exponential moving average
+        self.analysis_fps = 0.0
+        self.last_analysis_time = None
+        self.created = time.perf_counter()
+        self.first_result_latency = None
+
+        self._latest = None
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._analyse_frames, daemon=True)
+        self._thread.start()
+
+    def analyse(self, img):
+        with VIDEO_STAGE_SECONDS.time(stage="emotion"):
+            if self.detector_backend == "skip" and emotion_service.EMOTION_BATCHING:
+                # face crops from all sessions share batched forward passes
+                return emotion_service.get_service().infer(img).result(timeout=30)
+            # imported here, DeepFace pulls in TensorFlow
+            from deepface import DeepFace
+            analysis = DeepFace.analyze(img, actions=['emotion'], enforce_detection=False,
+                                        detector_backend=self.detector_backend)
+            return analysis[0]['dominant_emotion']
+
+    def submit(self, img):
+        # img must not be modified by the caller afterwards
+        with self._cond:
+            self._latest = img
+            self._cond.notify()
+
+    def clear(self):
+        # no face in view, drop the stale label
+        with self._cond:
+            self._latest = None
+        self.emotion = None
+
+    def _analyse_frames(self):
+        min_interval = 1 / self.max_analysis_fps if self.max_analysis_fps > 0 else 0
+        while True:
+            with self._cond:
+                while self._running and self._latest is None:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                img, self._latest = self._latest, None
+
+            started = time.time()
+            try:
+                self.emotion = self.analyse(img)
+            except Exception as e:
+                print(f"Error in analysis: {e}")
+                self.emotion = None
+            if self.governor is not None:
+                self.governor.record(time.time() - started)
+            if self.first_result_latency is None:
+                self.first_result_latency = time.perf_counter() - self.created
+                warmup.record("first_emotion", self.first_result_latency)
+
+            # Update emotion log every second
+            if self.emotion and time.time() - self.last_update >= 1:
+                self.emotion_log.append(self.emotion)
+                self.last_update = time.time()
+
+            now = time.time()
+            if self.last_analysis_time is not None:
+                self.analysis_fps = 0.8 * self.analysis_fps + 0.2 / (now - self.last_analysis_time)
+            self.last_analysis_time = now
+            if now - started < min_interval:
+                time.sleep(min_interval - (now - started))
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+
+class EmotionProcessor(VideoProcessorBase):
+    def __init__(self, analysis_fps=EMOTION_ANALYSIS_FPS):
+        super().__init__()
+        # an analysis should finish within the interval it runs at
+        target = 1 / analysis_fps if analysis_fps > 0 else GOVERNOR_TARGET_MS / 1000
+        self.governor = FrameGovernor(target_latency=target)
+        self.worker = EmotionWorker(analysis_fps, governor=self.governor)
+        self.display_fps = 0.0
+        self.last_display_time = None
+
+    @property
+    def emotion_log(self):
+        return self.worker.emotion_log
+
+    @property
+    def analysis_fps(self):
+        return self.worker.analysis_fps
+
+    def recv(self, frame: av.VideoFrame) -> av.VideoFrame:
+        with VIDEO_FRAME_SECONDS.time(processor="emotion"):
+            return self._recv(frame)
+
+    def _recv(self, frame):
+        with VIDEO_STAGE_SECONDS.time(stage="decode"):
+            img = frame.to_ndarray(format="bgr24")
+        if self.governor.admit(frame.time):
+            scale = self.governor.scale
+            if scale < 1:
+                self.worker.submit(cv2.resize(img, None, fx=scale, fy=scale,
+                                              interpolation=cv2.INTER_AREA))
+            else:
+                self.worker.submit(img.copy())
+
+        # Display the most recent emotion on screen
+        if self.worker.emotion:
+            cv2.putText(img, f"Emotion: {self.worker.emotion}", (20, 50),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        else:
+            cv2.putText(img, "No face detected", (20, 50),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+
+        now = time.time()
+        if self.last_display_time is not None and now > self.last_display_time:
+            self.display_fps = 0.9 * self.display_fps + 0.1 / (now - self.last_display_time)
+        self.last_display_time = now
+
+        with VIDEO_STAGE_SECONDS.time(stage="encode"):
+            return av.VideoFrame.from_ndarray(img, format="bgr24")
+
+    def on_ended(self):
+        self.worker.stop()
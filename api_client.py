@@ -0,0 +1,277 @@
+# api_client py
+"""
+HTTP client for the platform API, used by the Streamlit frontend.
+
+One requests.Session with a keep-alive connection pool is shared by every
+rerun and session of the Streamlit server (get_client()). Each endpoint has
+its own timeout; failures that cannot have changed anything on the server
+(failures to connect, 503 from admission control) are retried with backoff on
+every endpoint, and timeouts, connections lost after sending and other 5xx
+responses only on idempotent ones. The generation endpoints count as
+idempotent because identical requests are served from the response cache or
+coalesced into one generation, unless the body asks for "fresh" output.
+Client-side latency of every call is kept for stats() and recorded in the
+api_client_seconds histogram.
+
+Configuration (environment variables):
+
+- API_URL: base URL of the API (default http://localhost:5001)
+- API_POOL_SIZE: pooled keep-alive connections (default 32)
+- API_CONNECT_TIMEOUT: seconds to establish a connection (default 5)
+- API_RETRIES / API_BACKOFF: retries per call and base backoff in seconds
+  (defaults 2 and 0.5)
+"""
+
+import os
+import json
+import time
+import random
+import threading
+import collections
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from metrics import histogram, LLM_BUCKETS
+
+
+API_URL = os.environ.get("API_URL", "http://localhost:5001")
+API_POOL_SIZE = int(os.environ.get("API_POOL_SIZE", "32"))
+API_CONNECT_TIMEOUT = float(os.environ.get("API_CONNECT_TIMEOUT", "5"))
+API_RETRIES = int(os.environ.get("API_RETRIES", "2"))
+API_BACKOFF = float(os.environ.get("API_BACKOFF", "0.5"))
+
+# endpoint -> (read timeout in seconds, idempotent); for streams the read
+# timeout is the longest wait between two events
+ENDPOINTS = {
+    "/api/roadmap": (300, True),
+    "/api/quiz": (180, True),
+    "/api/quiz/stream": (120, True),
+    "/api/quiz/batch": (600, True),
+    "/api/generate-resource": (300, True),
+    "/api/generate-resource/stream": (120, True),
+    "/api/translate": (60, True),
+    "/api/prefetch": (5, True),
+    "/api/cache/stats": (10, True),
+    "/api/server/stats": (10, True),
+}
+DEFAULT_ENDPOINT = (60, False)
+
+API_CLIENT_SECONDS = histogram(
+    "api_client_seconds", "API call latency seen by the Streamlit frontend, including retries",
+    ["endpoint", "outcome"], LLM_BUCKETS,
+)
+API_CLIENT_FIRST_EVENT_SECONDS = histogram(
+    "api_client_first_event_seconds", "Time to the first event of a streamed API call",
+    ["endpoint"], LLM_BUCKETS,
+)
+
+
+class APIError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def endpoint_label(endpoint):
+    # the configured endpoint a path belongs to, e.g. /api/prefetch/<id> -> /api/prefetch
+    path = endpoint
+    while path and path not in ENDPOINTS:
+        path = path.rpartition("/")[0]
+    return path or endpoint
+
+
+def endpoint_settings(endpoint):
+    return ENDPOINTS.get(endpoint_label(endpoint), DEFAULT_ENDPOINT)
+
+
+def never_sent(error):
+    # whether a requests.ConnectionError happened while connecting, before the
+    # request reached the API; a connection reset while reading the response
+    # may come after the API has already processed the request
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    # urllib3's MaxRetryError wraps the underlying error
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, NewConnectionError)
+
+
+def iter_sse(response):
+    # (event, data) for each server-sent event until the "done" event; a
+    # stream that ends without it was cut off and raises APIError
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            if event == "done":
+                return
+            yield event, json.loads(line[len("data:"):])
+        elif not line:
+            event = None
+    raise APIError("API stream ended before it was complete")
+
+
+class APIClient:
+    def __init__(self, base_url=API_URL, pool_size=API_POOL_SIZE,
+                 connect_timeout=API_CONNECT_TIMEOUT, retries=API_RETRIES, backoff=API_BACKOFF):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        # endpoint -> recent latencies in seconds, and call/error/retry counts
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=500))
+        self._counts = collections.defaultdict(collections.Counter)
+
+    def _record(self, endpoint, outcome, seconds, attempts):
+        label = endpoint_label(endpoint)
+        API_CLIENT_SECONDS.observe(seconds, endpoint=label, outcome=outcome)
+        with self._lock:
+            self._latencies[label].append(seconds)
+            self._counts[label]["calls"] += 1
+            self._counts[label]["retries"] += attempts - 1
+            if outcome != "ok":
+                self._counts[label]["errors"] += 1
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * (2 ** (attempt - 1)) * (1 + random.random())
+
+    def _send(self, method, endpoint, data=None, stream=False):
+        # sends with retries, returns (response, attempts); the caller closes the response
+        read_timeout, idempotent = endpoint_settings(endpoint)
+        if isinstance(data, dict) and data.get("fresh"):
+            idempotent = False
+        if method in ("GET", "DELETE"):
+            idempotent = True
+        attempt = 0
+        while True:
+            attempt += 1
+            response = None
+            try:
+                response = self.session.request(
+                    method, f"{self.base_url}{endpoint}", json=data, stream=stream,
+                    timeout=(self.connect_timeout, read_timeout),
+                )
+                retryable = response.status_code == 503 or (
+                    idempotent and response.status_code >= 500
+                )
+                if not retryable or attempt > self.retries:
+                    return response, attempt
+                response.close()
+                print(f"{method} {endpoint} answered {response.status_code}, retrying")
+            except requests.ConnectionError as e:
+                # connect failures and timeouts are always safe to retry, a
+                # connection lost after sending only on idempotent calls
+                if attempt > self.retries or not (idempotent or never_sent(e)):
+                    raise APIError(f"Cannot reach the API: {e}") from e
+                print(f"{method} {endpoint} failed ({e}), retrying")
+            except requests.Timeout as e:
+                if not idempotent or attempt > self.retries:
+                    raise APIError(f"The API did not answer in time: {e}") from e
+                print(f"{method} {endpoint} timed out, retrying")
+            time.sleep(self._retry_delay(attempt, response))
+
+    def request(self, method, endpoint, data=None):
+        # parsed JSON (or text) of a successful response, APIError otherwise
+        started = time.perf_counter()
+        attempts = 1
+        outcome = "error"
+        try:
+            response, attempts = self._send(method, endpoint, data)
+            with response:
+                if response.status_code >= 400:
+                    raise APIError(f"Error: {response.status_code} - {response.text}",
+                                   response.status_code)
+                outcome = "ok"
+                try:
+                    return response.json()
+                except ValueError:
+                    return response.text
+        finally:
+            self._record(endpoint, outcome, time.perf_counter() - started, attempts)
+
+    def post(self, endpoint, data):
+        return self.request("POST", endpoint, data)
+
+    def get(self, endpoint):
+        return self.request("GET", endpoint)
+
+    def delete(self, endpoint):
+        return self.request("DELETE", endpoint)
+
+    def stream(self, endpoint, data):
+        # data of each server-sent event; an "error" event raises APIError.
+        # Latency is recorded to the first event and for the whole stream.
+        started = time.perf_counter()
+        attempts = 1
+        outcome = "error"
+        first = True
+        try:
+            response, attempts = self._send("POST", endpoint, data, stream=True)
+            with response:
+                if response.status_code >= 400:
+                    raise APIError(f"Error: {response.status_code} - {response.text}",
+                                   response.status_code)
+                for event, message in iter_sse(response):
+                    if event == "error":
+                        raise APIError(f"API Error: {message.get('error')}")
+                    if first:
+                        first = False
+                        API_CLIENT_FIRST_EVENT_SECONDS.observe(time.perf_counter() - started,
+                                                               endpoint=endpoint_label(endpoint))
+                    yield message
+                outcome = "ok"
+        except GeneratorExit:
+            outcome = "cancelled"
+            raise
+        except requests.RequestException as e:
+            # the connection broke mid-stream, the caller has partial output
+            raise APIError(f"API stream interrupted: {e}") from e
+        finally:
+            self._record(endpoint, outcome, time.perf_counter() - started, attempts)
+
+    def quiz_batch(self, course, items):
+        # {"questions": [...]} or {"error": ...} per item, in order
+        return self.post("/api/quiz/batch", {"course": course, "items": items})["quizzes"]
+
+    def stats(self):
+        # per endpoint: calls, errors, retries and latency percentiles in seconds
+        with self._lock:
+            result = {}
+            for endpoint, latencies in self._latencies.items():
+                values = sorted(latencies)
+
+                def percentile(q):
+                    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+                result[endpoint] = {
+                    **self._counts[endpoint],
+                    "p50": percentile(0.5),
+                    "p95": percentile(0.95),
+                    "last": latencies[-1] if latencies else 0.0,
+                }
+            return result
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # one client (and connection pool) per Streamlit server, shared by every session
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = APIClient()
+        return _client
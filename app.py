@@ -1,14 +1,23 @@
 #app py
 import streamlit as st
-import requests
 import json
+import uuid
+import threading
 import sys
 import os
 import pandas as pd
 from datetime import datetime
-from eyeTracking import EyeProcessor
-from facial_expressions import EmotionProcessor
-from streamlit_webrtc import webrtc_streamer
+from time import monotonic, sleep
+from itertools import islice
+import artifact_store
+import warmup
+from api_client import get_client, APIError
+
+# The vision modules (dlib, DeepFace/TensorFlow, WebRTC) are imported on the
+# Engagement Monitor page only; VISION_WARMUP=1 preloads them in the background
+script_started = monotonic()
+if warmup.VISION_WARMUP:
+    warmup.start()
 
 # Set page configuration
 st.set_page_config(
@@ -17,8 +26,9 @@ st.set_page_config(
     layout="wide"
 )
 
-# Define API URL (adjust if needed)
-API_URL = "http://localhost:5001"  # Flask runs on port 5001
+# Shared API client: pooled keep-alive connections, timeouts and retries
+# (set API_URL if the Flask API doesn't run on localhost:5001)
+client = get_client()
 
 # Initialize session state for storing quiz data
 if 'current_quiz' not in st.session_state:
@@ -33,29 +43,106 @@ if 'selected_answer' not in st.session_state:
     st.session_state.selected_answer = None
 if 'show_reason' not in st.session_state:
     st.session_state.show_reason = False
-if 'engagement_data' not in st.session_state:
-    st.session_state.engagement_data = []
+if 'quiz_stream' not in st.session_state:
+    st.session_state.quiz_stream = None
+if 'prefetch_id' not in st.session_state:
+    st.session_state.prefetch_id = None
+if 'session_key' not in st.session_state:
+    st.session_state.session_key = uuid.uuid4().hex
 
 # Navigation sidebar
 st.sidebar.title("AI Learning Platform")
 page = st.sidebar.radio(
     "Navigate", 
-    ["Home", "Learning Roadmap", "Learning Resources", "Quiz", "Engagement Monitor"]
+    ["Home", "Learning Roadmap", "Learning Resources", "Quiz", "Engagement Monitor"],
+    key="nav"
 )
+st.sidebar.text_input("Student ID", value="", placeholder="guest", key="user_id")
+
+# Generated roadmaps, resources and quizzes and the engagement history are kept
+# per user; without a Student ID (or as "guest") that is a per-session id, so
+# anonymous users never share data
+artifacts = artifact_store.get_store()
+if st.session_state.user_id and st.session_state.user_id != "guest":
+    owner = st.session_state.user_id
+else:
+    owner = f"guest:{st.session_state.session_key}"
+with st.sidebar.expander("API latency"):
+    for endpoint, endpoint_stats in client.stats().items():
+        st.caption(
+            f"{endpoint}: {endpoint_stats['calls']} calls, "
+            f"p50 {endpoint_stats['p50']:.2f}s, p95 {endpoint_stats['p95']:.2f}s, "
+            f"last {endpoint_stats['last']:.2f}s"
+            + (f", {endpoint_stats['errors']} errors" if endpoint_stats.get('errors') else "")
+            + (f", {endpoint_stats['retries']} retries" if endpoint_stats.get('retries') else "")
+        )
 
 # Helper function for API calls
 def api_call(endpoint, data):
     try:
-        response = requests.post(f"{API_URL}{endpoint}", json=data)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"Error: {response.status_code} - {response.text}")
-            return None
-    except Exception as e:
-        st.error(f"API Error: {str(e)}")
+        return client.post(endpoint, data)
+    except APIError as e:
+        st.error(str(e))
         return None
 
+# Streaming variant for server-sent event endpoints, yields each message's data;
+# status["done"] is set once the stream completed
+def api_stream(endpoint, data, status=None):
+    try:
+        yield from client.stream(endpoint, data)
+        if status is not None:
+            status["done"] = True
+    except APIError as e:
+        st.error(str(e))
+
+# Quiz questions are streamed by a background thread into a plain dict kept in
+# session_state, so the user can answer while later questions are generated.
+# The complete quiz is saved to the artifact store.
+def start_quiz_stream(data, owner):
+    stream = {"questions": [], "done": False, "error": None}
+
+    def run():
+        try:
+            for message in client.stream("/api/quiz/stream", data):
+                stream["questions"].append(message["question"])
+            if stream["questions"]:
+                artifacts.put(owner, "quiz", data, list(stream["questions"]),
+                              title=f"{data['subtopic']} ({data['course']})")
+        except APIError as e:
+            stream["error"] = str(e)
+        finally:
+            stream["done"] = True
+
+    threading.Thread(target=run, daemon=True).start()
+    return stream
+
+def wait_for_question(stream, count, timeout=180):
+    deadline = monotonic() + timeout
+    while len(stream["questions"]) < count and not stream["done"] and monotonic() < deadline:
+        sleep(0.1)
+    return len(stream["questions"]) >= count
+
+# Stop background quiz generation for a roadmap the user moved away from
+def cancel_prefetch():
+    if st.session_state.prefetch_id:
+        try:
+            client.delete(f"/api/prefetch/{st.session_state.prefetch_id}")
+        except APIError:
+            pass
+        st.session_state.prefetch_id = None
+
+# Opens the quiz of a roadmap subtopic with exactly the fields the roadmap's
+# quizzes were prefetched with (see prefetch.roadmap_quizzes)
+def take_quiz(fields):
+    st.session_state.pending_quiz = fields
+    st.session_state.current_quiz = None
+    st.session_state.nav = "Quiz"
+
+# Prefetched quizzes are taken from the roadmap's "Take quiz" buttons; on any
+# other page the roadmap was abandoned
+if page not in ("Learning Roadmap", "Quiz"):
+    cancel_prefetch()
+
 # Home page
 if page == "Home":
     st.title("Welcome to AI Personalized Learning Platform")
@@ -98,32 +185,62 @@ elif page == "Learning Roadmap":
         submit_button = st.form_submit_button("Generate Roadmap")
     
     if submit_button:
-        with st.spinner("Generating your personalized learning roadmap..."):
-            roadmap_data = api_call("/api/roadmap", {
-                "topic": topic,
-                "time": time,
-                "knowledge_level": knowledge_level
-            })
-            
+        fields = {"topic": topic, "time": time, "knowledge_level": knowledge_level}
+        artifact = artifacts.find(owner, "roadmap", fields)
+        if artifact is None:
+            cancel_prefetch()
+            st.session_state.prefetch_id = uuid.uuid4().hex
+            with st.spinner("Generating your personalized learning roadmap..."):
+                roadmap_data = api_call("/api/roadmap", {
+                    **fields,
+                    # quizzes for the roadmap's subtopics are prepared in the background
+                    "prefetch_quizzes": True,
+                    "prefetch_id": st.session_state.prefetch_id
+                })
             if roadmap_data:
-                st.success(f"Your personalized roadmap for learning {topic} is ready!")
-                
-                # Display the roadmap
-                for week, week_data in roadmap_data.items():
-                    with st.expander(f"{week.title()}: {week_data.get('topic', '')}"):
-                        for i, subtopic in enumerate(week_data.get("subtopics", [])):
-                            st.subheader(f"{i+1}. {subtopic.get('subtopic', '')}")
-                            st.caption(f"⏱️ Estimated time: {subtopic.get('time', 'Not specified')}")
-                            st.write(subtopic.get('description', ''))
-                
-                # Save roadmap option
-                if st.download_button(
-                    "Download Roadmap",
-                    data=json.dumps(roadmap_data, indent=4),
-                    file_name=f"{topic.replace(' ', '_')}_roadmap_{datetime.now().strftime('%Y%m%d')}.json",
-                    mime="application/json"
-                ):
-                    st.success("Roadmap downloaded successfully!")
+                artifact = artifacts.put(owner, "roadmap", fields, roadmap_data,
+                                         title=f"{topic} ({time}, {knowledge_level})")
+        if artifact is not None:
+            st.session_state.roadmap_artifact = artifact.key
+
+    # Show the selected (by default the latest) roadmap from the artifact store
+    roadmaps = artifacts.list(owner, "roadmap")
+    if roadmaps:
+        by_key = {artifact.key: artifact for artifact in roadmaps}
+        if st.session_state.get("roadmap_artifact") not in by_key:
+            st.session_state.roadmap_artifact = roadmaps[0].key
+        artifact = by_key[st.selectbox("Your roadmaps", list(by_key), key="roadmap_artifact",
+                                       format_func=lambda key: by_key[key].title)]
+        roadmap_data = artifact.value
+        topic = artifact.fields["topic"]
+
+        st.success(f"Your personalized roadmap for learning {topic} is ready!")
+
+        # Display the roadmap
+        for week, week_data in roadmap_data.items():
+            with st.expander(f"{week.title()}: {week_data.get('topic', '')}"):
+                for i, subtopic in enumerate(week_data.get("subtopics", [])):
+                    st.subheader(f"{i+1}. {subtopic.get('subtopic', '')}")
+                    st.caption(f"⏱️ Estimated time: {subtopic.get('time', 'Not specified')}")
+                    st.write(subtopic.get('description', ''))
+                    quiz_fields = {
+                        "course": topic,
+                        "topic": week_data.get("topic"),
+                        "subtopic": subtopic.get("subtopic"),
+                        "description": subtopic.get("description"),
+                    }
+                    if all(quiz_fields.values()):
+                        st.button("Take quiz", key=f"take_quiz_{week}_{i}",
+                                  on_click=take_quiz, args=(quiz_fields,))
+
+        # Save roadmap option
+        if st.download_button(
+            "Download Roadmap",
+            data=json.dumps(roadmap_data, indent=4),
+            file_name=f"{topic.replace(' ', '_')}_roadmap_{datetime.now().strftime('%Y%m%d')}.json",
+            mime="application/json"
+        ):
+            st.success("Roadmap downloaded successfully!")
 
 # Learning Resources page
 elif page == "Learning Resources":
@@ -147,28 +264,52 @@ elif page == "Learning Resources":
         submit_button = st.form_submit_button("Generate Resources")
     
     if submit_button:
-        with st.spinner("Generating personalized learning resources..."):
-            resources_data = api_call("/api/generate-resource", {
-                "course": course,
-                "knowledge_level": knowledge_level,
-                "description": description,
-                "time": time
-            })
-            
-            if resources_data and "content" in resources_data:
-                st.success(f"Here are your personalized resources for {course}:")
-                st.markdown(resources_data["content"])
-                
-                # Download option
-                if st.download_button(
-                    "Download Resources",
-                    data=resources_data["content"],
-                    file_name=f"{course.replace(' ', '_')}_resources_{datetime.now().strftime('%Y%m%d')}.md",
-                    mime="text/markdown"
-                ):
-                    st.success("Resources downloaded successfully!")
+        fields = {
+            "course": course,
+            "knowledge_level": knowledge_level,
+            "description": description,
+            "time": time
+        }
+        artifact = artifacts.find(owner, "resources", fields)
+        if artifact is None:
+            placeholder = st.empty()
+            placeholder.info("Generating personalized learning resources...")
+            content = ""
+            status = {"done": False}
+            for message in api_stream("/api/generate-resource/stream", fields, status):
+                content += message.get("content", "")
+                placeholder.markdown(content)
+            placeholder.empty()
+            # a failed or cut-off stream is not kept, the next request generates again
+            if content and status["done"]:
+                artifact = artifacts.put(owner, "resources", fields, content,
+                                         title=f"{course} ({knowledge_level}, {time})")
             else:
                 st.error("Failed to generate resources. Please try again.")
+        if artifact is not None:
+            st.session_state.resources_artifact = artifact.key
+
+    # Show the selected (by default the latest) resources from the artifact store
+    resources = artifacts.list(owner, "resources")
+    if resources:
+        by_key = {artifact.key: artifact for artifact in resources}
+        if st.session_state.get("resources_artifact") not in by_key:
+            st.session_state.resources_artifact = resources[0].key
+        artifact = by_key[st.selectbox("Your resources", list(by_key), key="resources_artifact",
+                                       format_func=lambda key: by_key[key].title)]
+        course = artifact.fields["course"]
+
+        st.success(f"Here are your personalized resources for {course}:")
+        st.markdown(artifact.value)
+
+        # Download option
+        if st.download_button(
+            "Download Resources",
+            data=artifact.value,
+            file_name=f"{course.replace(' ', '_')}_resources_{datetime.now().strftime('%Y%m%d')}.md",
+            mime="text/markdown"
+        ):
+            st.success("Resources downloaded successfully!")
 
 # Quiz page
 elif page == "Quiz":
@@ -184,23 +325,47 @@ elif page == "Quiz":
             
             submit_button = st.form_submit_button("Generate Quiz")
         
-        if submit_button:
+        # Earlier quizzes can be taken again without generating them
+        previous_quizzes = artifacts.list(owner, "quiz")
+        retake = None
+        if previous_quizzes:
+            by_key = {artifact.key: artifact for artifact in previous_quizzes}
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                selected = st.selectbox("Or retake one of your quizzes", list(by_key),
+                                        format_func=lambda key: by_key[key].title)
+            with col2:
+                if st.button("Retake Quiz"):
+                    retake = by_key[selected]
+
+        # a quiz opened from a roadmap subtopic
+        pending = st.session_state.pop("pending_quiz", None)
+
+        if submit_button or retake is not None or pending is not None:
+            fields = pending or {
+                "course": course,
+                "topic": topic,
+                "subtopic": subtopic,
+                "description": description
+            }
+            artifact = retake or artifacts.find(owner, "quiz", fields)
             with st.spinner("Generating quiz questions..."):
-                quiz_data = api_call("/api/quiz", {
-                    "course": course,
-                    "topic": topic,
-                    "subtopic": subtopic,
-                    "description": description
-                })
-                
-                if quiz_data and "questions" in quiz_data:
-                    st.session_state.current_quiz = quiz_data["questions"]
+                if artifact is not None:
+                    quiz_stream = {"questions": list(artifact.value), "done": True, "error": None}
+                else:
+                    quiz_stream = start_quiz_stream(fields, owner)
+                # Start as soon as the first question is ready
+                if wait_for_question(quiz_stream, 1):
+                    st.session_state.quiz_stream = quiz_stream
+                    st.session_state.current_quiz = quiz_stream["questions"]
                     st.session_state.current_question_idx = 0
                     st.session_state.score = 0
                     st.session_state.quiz_completed = False
                     st.session_state.selected_answer = None
                     st.session_state.show_reason = False
                     st.rerun()
+                else:
+                    st.error(quiz_stream["error"] or "Failed to generate quiz. Please try again.")
     
     # Display current quiz question
     else:
@@ -216,19 +381,25 @@ elif page == "Quiz":
             
             if st.button("Take Another Quiz"):
                 st.session_state.current_quiz = None
+                st.session_state.quiz_stream = None
                 st.rerun()
         
         # Display the current question
         else:
             questions = st.session_state.current_quiz
             idx = st.session_state.current_question_idx
+            quiz_stream = st.session_state.quiz_stream
+            generating = quiz_stream is not None and not quiz_stream["done"]
             
             if idx < len(questions):
                 current_q = questions[idx]
                 
                 # Progress bar
                 st.progress((idx) / len(questions))
-                st.write(f"Question {idx+1} of {len(questions)}")
+                if generating:
+                    st.write(f"Question {idx+1} of {len(questions)} (more questions are being generated...)")
+                else:
+                    st.write(f"Question {idx+1} of {len(questions)}")
                 
                 # Question and options
                 st.subheader(current_q["question"])
@@ -261,11 +432,16 @@ elif page == "Quiz":
                             st.rerun()
                     
                     with col3:
-                        if idx < len(questions) - 1:
+                        if idx < len(questions) - 1 or generating:
                             if st.button("Next Question"):
-                                st.session_state.current_question_idx += 1
-                                st.session_state.selected_answer = None
-                                st.session_state.show_reason = False
+                                with st.spinner("Generating the next question..."):
+                                    has_next = wait_for_question(quiz_stream, idx + 2) if generating else True
+                                if has_next:
+                                    st.session_state.current_question_idx += 1
+                                    st.session_state.selected_answer = None
+                                    st.session_state.show_reason = False
+                                else:
+                                    st.session_state.quiz_completed = True
                                 st.rerun()
                         else:
                             if st.button("Finish Quiz"):
@@ -291,6 +467,12 @@ elif page == "Quiz":
 
 # Engagement Monitor page
 elif page == "Engagement Monitor":
+    from engagement import EngagementProcessor
+    from facial_expressions import EMOTION_DISPLAY_FPS
+    import emotion_service
+    import engagement_store
+    from streamlit_webrtc import webrtc_streamer
+
     st.title("Student Engagement Monitor")
     st.markdown("""
     This feature helps track your engagement during learning sessions by monitoring:
@@ -298,89 +480,97 @@ elif page == "Engagement Monitor":
     - Facial expressions for emotional state
     """)
     
-    # Create two columns for the video feeds
+    # One camera stream shared by eye tracking and emotion analysis
     col1, col2 = st.columns(2)
     
     with col1:
-        st.subheader("Eye Tracking")
-        ctx_eye = webrtc_streamer(
-            key="eye-tracker",
-            video_processor_factory=EyeProcessor,
-            frontend_rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]}
+        st.subheader("Camera")
+        user_id = owner
+        ctx = webrtc_streamer(
+            key="engagement-monitor",
+            video_processor_factory=lambda: EngagementProcessor(user=user_id),
+            frontend_rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},
+            media_stream_constraints={"video": {"frameRate": {"ideal": EMOTION_DISPLAY_FPS}}, "audio": False}
         )
+        processor = ctx.video_processor
         
-        if ctx_eye.video_processor:
-            st.subheader("Reading Status Log")
-            if st.button("Clear Eye Tracking Log"):
-                ctx_eye.video_processor.status_log = []
-            
-            if ctx_eye.video_processor.status_log:
-                log_text = "\n".join(
-                    [f"{status[1]} - {status[0]}" 
-                     for status in ctx_eye.video_processor.status_log[-10:]]
-                )
-                st.text_area("Eye Tracking Log", value=log_text, height=150)
+        if processor:
+            st.caption(
+                f"{processor.fps:.1f} fps, "
+                f"{processor.process_time * 1000:.0f} ms per frame, "
+                f"emotion analysis {processor.analysis_fps:.1f} fps, "
+                f"mode: {processor.governor.mode}"
+            )
+            with st.expander("Frame governor"):
+                st.json(processor.governor.status())
+            if emotion_service.EMOTION_BATCHING:
+                with st.expander("Emotion inference service"):
+                    st.json(emotion_service.get_service().stats())
+        with st.expander("Model loading"):
+            st.json(warmup.status())
     
     with col2:
-        st.subheader("Emotion Analysis")
-        ctx_emotion = webrtc_streamer(
-            key="emotion-tracker",
-            video_processor_factory=EmotionProcessor,
-            frontend_rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]}
-        )
-        
-        if ctx_emotion.video_processor:
-            st.subheader("Emotion Log")
-            if st.button("Clear Emotion Log"):
-                ctx_emotion.video_processor.emotion_log = []
+        if processor:
+            st.subheader("Engagement Log")
+            if st.button("Clear Engagement Log"):
+                processor.status_log.clear()
+                processor.emotion_log.clear()
+                processor.engagement_log.clear()
             
-            if ctx_emotion.video_processor.emotion_log:
+            if processor.engagement_log:
+                recent = list(islice(reversed(processor.engagement_log), 10))[::-1]
                 log_text = "\n".join(
-                    [f"{status[1]} - {status[0]}" 
-                     for status in ctx_emotion.video_processor.emotion_log[-10:]]
+                    [f"{entry[2]} - {entry[0]}, {entry[1]}" 
+                     for entry in recent]
                 )
-                st.text_area("Emotion Log", value=log_text, height=150)
+                st.text_area("Engagement Log", value=log_text, height=150)
     
     # Engagement Analytics
     st.subheader("Engagement Analytics")
     
-    if ctx_eye.video_processor and ctx_emotion.video_processor:
-        # Calculate reading percentage
-        if ctx_eye.video_processor.status_log:
-            reading_count = sum(1 for status in ctx_eye.video_processor.status_log if status[0] == "Reading")
-            total_count = len(ctx_eye.video_processor.status_log)
-            reading_percentage = (reading_count / total_count) * 100 if total_count > 0 else 0
+    if processor:
+        # The logs keep running counts, so these are constant-time reads
+        if len(processor.status_log):
+            reading_percentage = processor.status_log.fraction("Reading") * 100
             
             st.metric("Reading Engagement", f"{reading_percentage:.1f}%")
+            window_cols = st.columns(len(processor.status_log.windows))
+            for window_col, window in zip(window_cols, processor.status_log.windows):
+                window_col.metric(
+                    f"Reading, last {window // 60} min",
+                    f"{processor.status_log.window_fraction('Reading', window) * 100:.1f}%"
+                )
         
         # Calculate emotion distribution
-        if ctx_emotion.video_processor.emotion_log:
-            emotions = [status[0] for status in ctx_emotion.video_processor.emotion_log]
-            emotion_counts = pd.Series(emotions).value_counts()
+        if len(processor.emotion_log):
+            emotion_counts = pd.Series(processor.emotion_log.distribution())
             
             st.write("Emotion Distribution")
             st.bar_chart(emotion_counts)
             
             # Engagement score based on positive emotions
             positive_emotions = ['happy', 'neutral']
-            positive_count = sum(1 for emotion in emotions if emotion in positive_emotions)
-            emotion_percentage = (positive_count / len(emotions)) * 100 if emotions else 0
+            emotion_percentage = processor.emotion_log.fraction(positive_emotions) * 100
             
             st.metric("Emotional Engagement", f"{emotion_percentage:.1f}%")
     
-    # Save engagement data
+    # Samples are stored automatically while the camera runs; saving just
+    # makes sure the latest ones are on disk
+    store = engagement_store.get_store()
     if st.button("Save Engagement Data"):
-        engagement_data = {
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "reading_percentage": reading_percentage if 'reading_percentage' in locals() else 0,
-            "emotion_percentage": emotion_percentage if 'emotion_percentage' in locals() else 0,
-            "emotion_distribution": emotion_counts.to_dict() if 'emotion_counts' in locals() else {}
-        }
-        st.session_state.engagement_data.append(engagement_data)
+        store.flush()
         st.success("Engagement data saved!")
     
     # Display historical engagement data
-    if st.session_state.engagement_data:
+    history_hours = st.selectbox("History", [1, 24, 24 * 7, 24 * 30], index=1,
+                                 format_func=lambda h: f"Last {h} hours" if h < 48 else f"Last {h // 24} days")
+    now = datetime.now().timestamp()
+    history = store.minutes(owner, now - history_hours * 3600, now)
+    if history:
         st.subheader("Historical Engagement Data")
-        df = pd.DataFrame(st.session_state.engagement_data)
-        st.line_chart(df[['reading_percentage', 'emotion_percentage']])
\ No newline at end of file
+        df = pd.DataFrame(history, columns=["time", "reading_percentage", "emotion_percentage", "samples"])
+        df["time"] = pd.to_datetime(df["time"], unit="s")
+        st.line_chart(df.set_index("time")[['reading_percentage', 'emotion_percentage']])
+
+# Cold start of this Streamlit server: imports and first page render
+warmup.record_once("startup", monotonic() - script_started)
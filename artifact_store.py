@@ -0,0 +1,127 @@
+import os
+import time
+import threading
+import collections
+
+from cache import make_key
+
+# Generated roadmaps, resources and quizzes of the Streamlit server, kept per
+# user so every rerun and page visit re-renders them without another
+# generation. Artifacts are keyed by (user, kind, normalized request fields),
+# so asking again for the same thing is answered from here as well. The store
+# is an in-process LRU bounded both overall and per user, with a TTL.
+ARTIFACT_STORE_MAX_ENTRIES = int(os.environ.get("ARTIFACT_STORE_MAX_ENTRIES", "1000"))
+ARTIFACT_STORE_MAX_PER_USER = int(os.environ.get("ARTIFACT_STORE_MAX_PER_USER", "20"))
+ARTIFACT_STORE_TTL = float(os.environ.get("ARTIFACT_STORE_TTL", str(24 * 3600)))
+
+Artifact = collections.namedtuple("Artifact", "key kind title fields value created")
+
+
+class ArtifactStore:
+    def __init__(self, max_entries=ARTIFACT_STORE_MAX_ENTRIES,
+                 max_per_user=ARTIFACT_STORE_MAX_PER_USER, ttl=ARTIFACT_STORE_TTL):
+        self.max_entries = max_entries
+        self.max_per_user = max_per_user
+        self.ttl = ttl
+        # (user, key) -> Artifact, least recently used first
+        self._entries = collections.OrderedDict()
+        # user -> ordered set of that user's keys, least recently used first
+        self._users = collections.defaultdict(collections.OrderedDict)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remove(self, user, key):
+        self._entries.pop((user, key), None)
+        keys = self._users.get(user)
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self._users[user]
+
+    def _expired(self, artifact, now):
+        return self.ttl and now - artifact.created > self.ttl
+
+    def _touch(self, user, key):
+        self._entries.move_to_end((user, key))
+        self._users[user].move_to_end(key)
+
+    def put(self, user, kind, fields, value, title=None):
+        key = make_key(kind, fields)
+        artifact = Artifact(key, kind, title or kind, dict(fields), value, time.time())
+        with self._lock:
+            self._entries[(user, key)] = artifact
+            self._users[user][key] = None
+            self._touch(user, key)
+            keys = self._users[user]
+            while len(keys) > self.max_per_user:
+                self._remove(user, next(iter(keys)))
+                self.evictions += 1
+            while len(self._entries) > self.max_entries:
+                (old_user, old_key), _ = next(iter(self._entries.items()))
+                self._remove(old_user, old_key)
+                self.evictions += 1
+        return artifact
+
+    def get(self, user, key):
+        # the artifact stored under key, without counting as a use
+        with self._lock:
+            artifact = self._entries.get((user, key))
+            if artifact is not None and self._expired(artifact, time.time()):
+                self._remove(user, key)
+                return None
+            return artifact
+
+    def find(self, user, kind, fields):
+        # the artifact for an identical request, or None
+        key = make_key(kind, fields)
+        with self._lock:
+            artifact = self._entries.get((user, key))
+            if artifact is not None and self._expired(artifact, time.time()):
+                self._remove(user, key)
+                artifact = None
+            if artifact is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touch(user, key)
+            return artifact
+
+    def list(self, user, kind):
+        # the user's artifacts of one kind, newest first
+        now = time.time()
+        with self._lock:
+            artifacts = [
+                self._entries[(user, key)] for key in self._users.get(user, ())
+            ]
+            for artifact in artifacts:
+                if self._expired(artifact, now):
+                    self._remove(user, artifact.key)
+        return sorted(
+            (a for a in artifacts if a.kind == kind and not self._expired(a, now)),
+            key=lambda a: a.created, reverse=True,
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "users": len(self._users),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    # one store per Streamlit server, shared by every session
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ArtifactStore()
+        return _store
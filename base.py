@@ -1,24 +1,67 @@
 #base py 
-from flask import Flask, request
+import json
+import time
+import uuid
+from flask import Flask, Response, request, stream_with_context
 import roadmap
 import quiz
 import generativeResources
+import cache
+import singleflight
+import semantic_cache
+import serving
+import prefetch
+import metrics
 from flask_cors import CORS
 
 api = Flask(__name__)
 CORS(api)
 
+response_cache = cache.ResponseCache()
+flight = singleflight.SingleFlight(response_cache)
+semantic = semantic_cache.SemanticIndex(response_cache)
+prefetcher = prefetch.QuizPrefetcher(flight, semantic=semantic)
+
+admission = serving.AdmissionControl(api.wsgi_app)
+api.wsgi_app = admission
+
+
+def sse(data, event=None):
+    message = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{message}" if event else message
+
 
 @api.route("/api/roadmap", methods=["POST"])
 def get_roadmap():
     req = request.get_json()
 
-    response_body = roadmap.create_roadmap(
-        topic=req.get("topic", "Machine Learning"),
-        time=req.get("time", "4 weeks"),
-        knowledge_level=req.get("knowledge_level", "Absoulte Beginner"),
+    # "parallel" generates an outline first and then every week concurrently;
+    # both modes produce the same shape, so they share cache entries
+    if req.get("mode", roadmap.ROADMAP_MODE) == "parallel":
+        generate_roadmap = roadmap.create_roadmap_parallel
+    else:
+        generate_roadmap = roadmap.create_roadmap
+
+    fields = {
+        "topic": req.get("topic", "Machine Learning"),
+        "time": req.get("time", "4 weeks"),
+        "knowledge_level": req.get("knowledge_level", "Absoulte Beginner"),
+    }
+    response_body = semantic.get_or_create(
+        flight,
+        "roadmap",
+        fields,
+        lambda: generate_roadmap(**fields),
+        fresh=bool(req.get("fresh")),
     )
 
+    if prefetch.PREFETCH_ENABLED and req.get("prefetch_quizzes"):
+        # quizzes for every subtopic are generated in the background; the id
+        # can be used to cancel them when the user moves on
+        prefetch_id = req.get("prefetch_id") or uuid.uuid4().hex
+        prefetcher.submit(prefetch_id, fields["topic"], response_body)
+        return response_body, 200, {"X-Prefetch-Id": prefetch_id}
+
     return response_body
 
 
@@ -35,10 +78,115 @@ def get_quiz():
         return "Required Fields not provided", 400
 
     print("getting quiz...")
-    response_body = quiz.get_quiz(course, topic, subtopic, description)
+    response_body = semantic.get_or_create(
+        flight,
+        "quiz",
+        {"course": course, "topic": topic, "subtopic": subtopic, "description": description},
+        lambda: quiz.get_quiz(course, topic, subtopic, description),
+        fresh=bool(req.get("fresh")),
+    )
     return response_body
 
 
+@api.route("/api/quiz/stream", methods=["POST"])
+def get_quiz_stream():
+    # Server-sent events: one {"question": {...}} message per question as soon
+    # as it is generated, then a "done" event
+    req = request.get_json()
+
+    fields = {
+        "course": req.get("course"),
+        "topic": req.get("topic"),
+        "subtopic": req.get("subtopic"),
+        "description": req.get("description"),
+    }
+    if not all(fields.values()):
+        return "Required Fields not provided", 400
+
+    print("streaming quiz...")
+    key = cache.make_key("quiz", fields)
+    # before the lookup, so a result stored right after the miss is used
+    since = time.time()
+    cached = None
+    if not req.get("fresh"):
+        cached = response_cache.get(key, "quiz") or semantic.lookup("quiz", fields)
+
+    def events():
+        if cached is not None:
+            for question in cached.get("questions", []):
+                yield sse({"question": question})
+            yield sse({}, event="done")
+            return
+        try:
+            # shares the generation with identical concurrent requests,
+            # including a prefetch of the same quiz
+            for question in flight.stream(
+                key,
+                "quiz",
+                lambda: quiz.stream_quiz(**fields),
+                collect=lambda questions: {"questions": questions} if questions else None,
+                replay=lambda value: value.get("questions", []),
+                stored=lambda value, seconds: semantic.add("quiz", fields, value, seconds),
+                since=since,
+            ):
+                yield sse({"question": question})
+        except Exception as e:
+            print(f"quiz stream failed: {e}")
+            yield sse({"error": str(e)}, event="error")
+            return
+        yield sse({}, event="done")
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@api.route("/api/quiz/batch", methods=["POST"])
+def get_quiz_batch():
+    # {"course": ..., "items": [{"topic", "subtopic", "description"}, ...]}, an
+    # item may carry its own "course"
+    req = request.get_json()
+
+    items = []
+    for item in req.get("items") or []:
+        fields = {
+            "course": item.get("course", req.get("course")),
+            "topic": item.get("topic"),
+            "subtopic": item.get("subtopic"),
+            "description": item.get("description"),
+        }
+        if not all(fields.values()):
+            return "Required Fields not provided", 400
+        items.append(fields)
+    if not items:
+        return "Required Fields not provided", 400
+
+    print(f"getting {len(items)} quizzes...")
+    quizzes = [None] * len(items)
+    missing = []
+    for i, fields in enumerate(items):
+        if not req.get("fresh"):
+            quizzes[i] = (response_cache.get(cache.make_key("quiz", fields), "quiz")
+                          or semantic.lookup("quiz", fields))
+        if quizzes[i] is None:
+            missing.append(i)
+
+    if missing:
+        started = time.perf_counter()
+        generated = quiz.get_quiz_batch([items[i] for i in missing])
+        # the quizzes are generated concurrently, each is charged an equal share
+        seconds = (time.perf_counter() - started) / len(missing)
+        for i, result in zip(missing, generated):
+            if "error" not in result:
+                response_cache.set(cache.make_key("quiz", items[i]), "quiz", result)
+                semantic.add("quiz", items[i], result, seconds)
+            quizzes[i] = result
+
+    return {"quizzes": quizzes}
+
+
 @api.route("/api/translate", methods=["POST"])
 def get_translations():
     req = request.get_json()
@@ -51,9 +199,7 @@ def get_translations():
     return translated_text
 
 
-@api.route("/api/generate-resource", methods=["POST"])
-def generative_resource():
-    req = request.get_json()
+def resource_fields(req):
     req_data = {
         "course": False,
         "knowledge_level": False,
@@ -63,10 +209,102 @@ def generative_resource():
     for key in req_data.keys():
         req_data[key] = req.get(key)
         if not req_data[key]:
-            return "Required Fields not provided", 400
+            return None
+    return req_data
+
+
+@api.route("/api/generate-resource", methods=["POST"])
+def generative_resource():
+    req = request.get_json()
+    req_data = resource_fields(req)
+    if req_data is None:
+        return "Required Fields not provided", 400
     print(f"generative resources for {req_data['course']}")
-    resources = generativeResources.generate_resources(**req_data)
+    resources = flight.get_or_create(
+        "generate-resource",
+        req_data,
+        lambda: generativeResources.generate_resources(**req_data),
+        fresh=bool(req.get("fresh")),
+    )
     return resources
 
+
+@api.route("/api/generate-resource/stream", methods=["POST"])
+def generative_resource_stream():
+    # Server-sent events: one {"content": chunk} message per chunk, then a "done" event
+    req = request.get_json()
+    req_data = resource_fields(req)
+    if req_data is None:
+        return "Required Fields not provided", 400
+    print(f"streaming generative resources for {req_data['course']}")
+
+    key = cache.make_key("generate-resource", req_data)
+    since = time.time()
+    cached = None if req.get("fresh") else response_cache.get(key, "generate-resource")
+
+    def events():
+        if cached is not None:
+            yield sse({"content": json.loads(cached)["content"]})
+            yield sse({}, event="done")
+            return
+        try:
+            # identical concurrent requests wait for one generation and get
+            # its content in one message
+            for chunk in flight.stream(
+                key,
+                "generate-resource",
+                lambda: generativeResources.stream_resources(**req_data),
+                collect=lambda chunks: json.dumps({"content": "".join(chunks)}),
+                replay=lambda value: [json.loads(value)["content"]],
+                since=since,
+            ):
+                yield sse({"content": chunk})
+        except Exception as e:
+            print(f"resource stream failed: {e}")
+            yield sse({"error": str(e)}, event="error")
+            return
+        yield sse({}, event="done")
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@api.route("/api/cache/stats", methods=["GET"])
+def cache_stats():
+    stats = response_cache.stats()
+    stats["singleflight"] = flight.stats()
+    stats["semantic"] = semantic.stats()
+    return stats
+
+
+@api.route("/api/prefetch", methods=["GET"])
+def prefetch_stats():
+    return prefetcher.stats()
+
+
+@api.route("/api/prefetch/<prefetch_id>", methods=["GET"])
+def prefetch_status(prefetch_id):
+    return prefetcher.status(prefetch_id)
+
+
+@api.route("/api/prefetch/<prefetch_id>", methods=["DELETE"])
+def cancel_prefetch(prefetch_id):
+    return {"cancelled": prefetcher.cancel(prefetch_id)}
+
+
+@api.route("/api/server/stats", methods=["GET"])
+def server_stats():
+    return admission.stats()
+
+
+@api.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    # histograms of this process plus the Streamlit and frame pool processes, see metrics.py
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
-    api.run(host="0.0.0.0", port=5001, debug=True)
+    serving.serve(api, admission)
@@ -0,0 +1,322 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import platform
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Headless benchmark of the video processors: recorded videos or synthetic
+# frames are fed through recv() the way streamlit-webrtc does, at several
+# resolutions and face counts, without a browser or webcam. Each case runs in a
+# fresh process so model loading, CPU time and peak memory are its own.
+#
+#   python bench_vision.py --face-image face.jpg --faces 0,1,4 --resolutions 640x480,1280x720
+#   python bench_vision.py --video lecture.mp4 --output new.json --compare old.json
+PROCESSORS = ("eye", "emotion", "engagement")
+SYNTHETIC_VARIANTS = 16
+
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def make_processor(name):
+    if name == "eye":
+        from eyeTracking import EyeProcessor
+        return EyeProcessor()
+    if name == "emotion":
+        from facial_expressions import EmotionProcessor
+        return EmotionProcessor()
+    if name == "engagement":
+        from engagement import EngagementProcessor
+        return EngagementProcessor()
+    raise ValueError(f"unknown processor {name!r}")
+
+
+def synthetic_frames(resolution, faces, face_image=None):
+    # faces copies of face_image on a grid over a plain background; each variant
+    # shifts them a few pixels so trackers see motion from frame to frame
+    width, height = resolution
+    background = np.full((height, width, 3), 96, dtype=np.uint8)
+    if not faces:
+        return [background]
+    if face_image is None:
+        raise ValueError("synthetic frames with faces need --face-image")
+    face = cv2.imread(face_image)
+    if face is None:
+        raise ValueError(f"cannot read {face_image}")
+
+    cols = int(np.ceil(np.sqrt(faces)))
+    rows = int(np.ceil(faces / cols))
+    cell_w, cell_h = width // cols, height // rows
+    scale = min(cell_w / face.shape[1], cell_h / face.shape[0]) * 0.8
+    face = cv2.resize(face, (int(face.shape[1] * scale), int(face.shape[0] * scale)),
+                      interpolation=cv2.INTER_AREA)
+    face_h, face_w = face.shape[:2]
+
+    frames = []
+    for variant in range(SYNTHETIC_VARIANTS):
+        img = background.copy()
+        shift = variant % 8 - 4
+        for i in range(faces):
+            row, col = divmod(i, cols)
+            x = col * cell_w + (cell_w - face_w) // 2 + shift
+            y = row * cell_h + (cell_h - face_h) // 2
+            x = min(max(x, 0), width - face_w)
+            img[y:y + face_h, x:x + face_w] = face
+        frames.append(img)
+    return frames
+
+
+def video_frames(path, resolution):
+    # endless decoded frames of a video resized to resolution, rewinding at the end
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"cannot open {path}")
+    try:
+        while True:
+            ok, img = capture.read()
+            if not ok:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, img = capture.read()
+                if not ok:
+                    raise ValueError(f"no frames in {path}")
+            if (img.shape[1], img.shape[0]) != resolution:
+                img = cv2.resize(img, resolution, interpolation=cv2.INTER_AREA)
+            yield img
+    finally:
+        capture.release()
+
+
+def peak_rss_mb():
+    # peak resident memory of this process, None where that isn't available
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    # peak working set on Windows
+    return getattr(memory, "peak_wset", memory.rss) / (1024 * 1024)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+
+def run_case(case):
+    import av
+
+    resolution = tuple(case["resolution"])
+    if case["source"] == "synthetic":
+        variants = synthetic_frames(resolution, case["faces"], case.get("face_image"))
+        frames = itertools.cycle(variants)
+    else:
+        frames = video_frames(case["source"], resolution)
+
+    processor = make_processor(case["processor"])
+    # with the governor on, skipped and downscaled frames would count as
+    # processed ones; it is off unless --governor is given
+    processor.governor.enabled = case["governor"]
+    latencies = []
+    try:
+        # warm-up frames load models and fill caches, they are not measured
+        for _ in range(case["warmup"]):
+            processor.recv(av.VideoFrame.from_ndarray(next(frames), format="bgr24"))
+
+        interval = 1 / case["rate"] if case["rate"] else 0
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for i in range(case["frames"]):
+            frame = av.VideoFrame.from_ndarray(next(frames), format="bgr24")
+            if interval:
+                # pace like a camera, so background analysis gets realistic gaps
+                delay = wall_start + i * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            started = time.perf_counter()
+            processor.recv(frame)
+            latencies.append(time.perf_counter() - started)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+    finally:
+        if hasattr(processor, "on_ended"):
+            processor.on_ended()
+
+    latencies_ms = np.array(latencies) * 1000
+    busy = float(np.sum(latencies))
+    result = {
+        "processor": case["processor"],
+        "source": case["source"],
+        "resolution": f"{resolution[0]}x{resolution[1]}",
+        "faces": case["faces"] if case["source"] == "synthetic" else None,
+        "frames": len(latencies),
+        # frames per second of recv time, independent of --rate pacing
+        "fps": len(latencies) / busy if busy > 0 else 0.0,
+        "wall_seconds": wall,
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()) if len(latencies_ms) else 0.0,
+            "p50": percentile(latencies_ms, 50),
+            "p95": percentile(latencies_ms, 95),
+            "p99": percentile(latencies_ms, 99),
+            "max": float(latencies_ms.max()) if len(latencies_ms) else 0.0,
+        },
+        # process CPU time including background analysis threads
+        "cpu_seconds": cpu,
+        "cpu_percent": cpu * 100 / wall if wall > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if hasattr(processor, "detections"):
+        result["detections"] = processor.detections
+    if hasattr(processor, "analysis_fps"):
+        result["analysis_fps"] = processor.analysis_fps
+    if case["governor"]:
+        result["governor"] = processor.governor.status()
+    return result
+
+
+def run_isolated(case):
+    # spawn, not fork: every case starts without models or frames loaded
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_case, case).result()
+
+
+def case_key(result):
+    return (result["processor"], result["source"], result["resolution"], result["faces"])
+
+
+def compare(results, baseline, threshold):
+    # prints fps and p95 latency against a previous run, returns the regressed cases
+    previous = {case_key(r): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'case':<48} {'fps':>18} {'p95 ms':>20}")
+    for result in results:
+        old = previous.get(case_key(result))
+        name = " ".join(str(part) for part in case_key(result) if part is not None)
+        if old is None:
+            print(f"{name:<48} {'(new)':>18}")
+            continue
+        fps_change = (result["fps"] - old["fps"]) / old["fps"] if old["fps"] else 0.0
+        old_p95, new_p95 = old["latency_ms"]["p95"], result["latency_ms"]["p95"]
+        p95_change = (new_p95 - old_p95) / old_p95 if old_p95 else 0.0
+        regressed = fps_change < -threshold or p95_change > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<48} {old['fps']:7.1f} -> {result['fps']:7.1f} "
+              f"{old_p95:8.1f} -> {new_p95:8.1f}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the video processors on recorded or synthetic frames.")
+    parser.add_argument("--processors", default=",".join(PROCESSORS),
+                        help="comma separated, any of eye, emotion, engagement")
+    parser.add_argument("--video", action="append", default=[],
+                        help="recorded video to replay, can be given several times")
+    parser.add_argument("--face-image", help="face photo tiled into the synthetic frames")
+    parser.add_argument("--faces", default="0,1",
+                        help="face counts of the synthetic frames (ignored for videos)")
+    parser.add_argument("--no-synthetic", action="store_true", help="only replay --video files")
+    parser.add_argument("--resolutions", default="640x480,1280x720")
+    parser.add_argument("--frames", type=int, default=300, help="measured frames per case")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured frames per case")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="feed frames at this fps like a camera (default: as fast as possible)")
+    parser.add_argument("--governor", action="store_true",
+                        help="keep the frame governor on (results then include its mode and skipped frames)")
+    parser.add_argument("--no-isolate", action="store_true",
+                        help="run every case in this process (peak memory then accumulates)")
+    parser.add_argument("--output", default="bench_vision.json")
+    parser.add_argument("--compare", help="previous --output file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative fps drop or p95 increase reported as a regression")
+    args = parser.parse_args(argv)
+
+    processors = [p.strip() for p in args.processors.split(",") if p.strip()]
+    for name in processors:
+        if name not in PROCESSORS:
+            parser.error(f"unknown processor {name!r}")
+    resolutions = [parse_resolution(r) for r in args.resolutions.split(",")]
+    face_counts = [int(n) for n in args.faces.split(",")]
+    if not args.face_image:
+        face_counts = [n for n in face_counts if n == 0]
+
+    sources = [(path, None) for path in args.video]
+    if not args.no_synthetic:
+        sources += [("synthetic", n) for n in face_counts]
+    if not sources:
+        parser.error("nothing to run, give --video or allow synthetic frames")
+
+    run = run_case if args.no_isolate else run_isolated
+    results = []
+    for processor in processors:
+        for source, faces in sources:
+            for resolution in resolutions:
+                case = {
+                    "processor": processor, "source": source, "faces": faces,
+                    "face_image": args.face_image, "resolution": resolution,
+                    "frames": args.frames, "warmup": args.warmup, "rate": args.rate,
+                    "governor": args.governor,
+                }
+                result = run(case)
+                results.append(result)
+                rss = result["peak_rss_mb"]
+                print(f"{processor:<11} {source if faces is None else f'synthetic x{faces}':<24} "
+                      f"{result['resolution']:>10}  {result['fps']:7.1f} fps  "
+                      f"p50 {result['latency_ms']['p50']:6.1f} ms  p95 {result['latency_ms']['p95']:6.1f} ms  "
+                      f"p99 {result['latency_ms']['p99']:6.1f} ms  cpu {result['cpu_percent']:5.0f}%  "
+                      f"rss {'-' if rss is None else f'{rss:.0f}':>6} MB", flush=True)
+
+    report = {
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {k: v for k, v in os.environ.items()
+                     if k.startswith(("EYE_", "EMOTION_", "FRAME_POOL_", "GOVERNOR_", "READING_"))},
+        "args": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
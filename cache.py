@@ -0,0 +1,168 @@
+# cache py
+"""
+Persistent response cache for the generation endpoints.
+
+Entries are keyed on the endpoint name and the normalized request fields and
+stored in a SQLite file, so they survive restarts and are shared by every
+worker process pointing at the same path. Eviction is LRU with a TTL and a
+maximum number of entries.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+def normalize(value):
+    # "  Machine   learning " and "machine learning" should share an entry
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    return value
+
+
+def make_key(endpoint, fields):
+    payload = json.dumps(
+        {"endpoint": endpoint, "fields": normalize(fields)},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._init_db()
+
+    def _conn(self):
+        # sqlite connections can't be shared between threads, keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+        )
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS stats (
+                endpoint TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+
+    def _count(self, endpoint, column):
+        self._conn().execute(
+            f"INSERT INTO stats (endpoint, {column}) VALUES (?, 1) "
+            f"ON CONFLICT(endpoint) DO UPDATE SET {column} = {column} + 1",
+            (endpoint,),
+        )
+
+    def get(self, key, endpoint):
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._count(endpoint, "misses")
+            return None
+        conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        self._count(endpoint, "hits")
+        return json.loads(row[0])
+
+    def peek(self, key, since=0):
+        # lookup that doesn't touch LRU order or hit/miss counters
+        row = self._conn().execute(
+            "SELECT value FROM responses WHERE key = ? AND created >= ?", (key, since)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, key, endpoint, value):
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, endpoint, value, created, last_access) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, endpoint, json.dumps(value), now, now),
+        )
+        self.evict(now)
+
+    def evict(self, now=None):
+        now = time.time() if now is None else now
+        conn = self._conn()
+        conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def get_or_create(self, endpoint, fields, generate, fresh=False):
+        # fresh=True skips the lookup but still stores the new generation
+        key = make_key(endpoint, fields)
+        if not fresh:
+            value = self.get(key, endpoint)
+            if value is not None:
+                return value
+        value = generate()
+        self.set(key, endpoint, value)
+        return value
+
+    def stats(self):
+        conn = self._conn()
+        size = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        endpoints = {
+            endpoint: {"hits": hits, "misses": misses}
+            for endpoint, hits, misses in conn.execute(
+                "SELECT endpoint, hits, misses FROM stats"
+            )
+        }
+        return {
+            "entries": size,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "endpoints": endpoints,
+        }
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM responses")
+        conn.execute("DELETE FROM stats")
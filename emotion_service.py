@@ -0,0 +1,149 @@
+import os
+import time
+import queue
+import threading
+import collections
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+from metrics import VIDEO_STAGE_SECONDS
+
+# Shared in-process emotion inference: face crops from every active session are
+# collected into micro-batches (up to EMOTION_BATCH_SIZE crops, waiting at most
+# EMOTION_BATCH_WAIT_MS for a batch to fill) and classified with one forward
+# pass of a single DeepFace emotion model.
+EMOTION_BATCHING = os.environ.get("EMOTION_BATCHING", "1") == "1"
+EMOTION_BATCH_SIZE = int(os.environ.get("EMOTION_BATCH_SIZE", "32"))
+EMOTION_BATCH_WAIT_MS = float(os.environ.get("EMOTION_BATCH_WAIT_MS", "20"))
+
+EMOTION_LABELS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+EMOTION_INPUT_SIZE = (48, 48)
+
+
+def load_emotion_model():
+    from deepface import DeepFace
+
+    try:
+        model = DeepFace.build_model(model_name="Emotion", task="facial_attribute")
+    except TypeError:
+        # older deepface releases take only the model name
+        model = DeepFace.build_model("Emotion")
+    # newer releases wrap the keras model in a client object
+    return getattr(model, "model", model)
+
+
+def preprocess(crop):
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, EMOTION_INPUT_SIZE, interpolation=cv2.INTER_AREA)
+    return gray.astype(np.float32)[..., np.newaxis] / 255.0
+
+
+class EmotionService:
+    def __init__(self, max_batch_size=EMOTION_BATCH_SIZE, max_wait_ms=EMOTION_BATCH_WAIT_MS,
+                 model=None):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._model = model
+        # seconds it took to load the model, None until it was loaded here
+        self.model_load_time = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+        self.started = time.time()
+        self.processed = 0
+        self.batches = 0
+        self.batch_sizes = collections.Counter()
+        self.queue_latencies = collections.deque(maxlen=1000)
+        self.inference_times = collections.deque(maxlen=1000)
+
+        self._thread = threading.Thread(target=self._run, name="emotion-service", daemon=True)
+        self._thread.start()
+
+    def infer(self, crop):
+        # returns a Future resolving to the dominant emotion label of a BGR face crop
+        future = Future()
+        self._queue.put((crop, future, time.monotonic()))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            try:
+                if self._model is None:
+                    load_started = time.monotonic()
+                    self._model = load_emotion_model()
+                    self.model_load_time = time.monotonic() - load_started
+                    started = time.monotonic()
+                inputs = np.stack([preprocess(crop) for crop, _, _ in batch])
+                with VIDEO_STAGE_SECONDS.time(stage="emotion_batch"):
+                    scores = self._model.predict(inputs, verbose=0)
+                labels = [EMOTION_LABELS[i] for i in np.argmax(scores, axis=1)]
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.monotonic()
+
+            with self._lock:
+                self.processed += len(batch)
+                self.batches += 1
+                self.batch_sizes[len(batch)] += 1
+                self.queue_latencies.extend(started - queued for _, _, queued in batch)
+                self.inference_times.append(finished - started)
+            for (_, future, _), label in zip(batch, labels):
+                future.set_result(label)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self.queue_latencies)
+            elapsed = time.time() - self.started
+
+            def percentile(values, q):
+                return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+            return {
+                "processed": self.processed,
+                "batches": self.batches,
+                "throughput": self.processed / elapsed if elapsed > 0 else 0.0,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "mean_batch_size": self.processed / self.batches if self.batches else 0.0,
+                "queue_latency_p50": percentile(latencies, 0.5),
+                "queue_latency_p95": percentile(latencies, 0.95),
+                "mean_inference_time": (sum(self.inference_times) / len(self.inference_times)
+                                        if self.inference_times else 0.0),
+                "queued": self._queue.qsize(),
+            }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    # one service per process, shared by every Streamlit session
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = EmotionService()
+        return _service
+
+
+def loaded_service():
+    # the shared service if it was started, without starting it
+    return _service
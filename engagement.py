@@ -0,0 +1,86 @@
+import cv2
+import time
+import collections
+from eyeTracking import EyeProcessor
+from facial_expressions import EmotionWorker, EMOTION_ANALYSIS_FPS
+from engagement_log import DEFAULT_CAPACITY
+import engagement_store
+
+# One processor for the whole Engagement Monitor: the webcam stream is decoded
+# once, faces are located once by the eye tracker, and the face crop is handed
+# to the emotion worker (with DeepFace's own detector skipped).
+FACE_CROP_MARGIN = 0.1
+
+
+def crop_face(img, face, margin=FACE_CROP_MARGIN):
+    pad_x = int(face.width() * margin)
+    pad_y = int(face.height() * margin)
+    top = max(0, face.top() - pad_y)
+    bottom = min(img.shape[0], face.bottom() + pad_y)
+    left = max(0, face.left() - pad_x)
+    right = min(img.shape[1], face.right() + pad_x)
+    if bottom <= top or right <= left:
+        return None
+    return img[top:bottom, left:right].copy()
+
+
+class EngagementProcessor(EyeProcessor):
+    metrics_name = "engagement"
+
+    def __init__(self, analysis_fps=EMOTION_ANALYSIS_FPS, user=None, session=None, **eye_options):
+        super().__init__(**eye_options)
+        # with a user, every per-second sample is also persisted
+        self.user = user
+        self.session = session or time.strftime("%Y%m%d-%H%M%S")
+        self.store = engagement_store.get_store() if user else None
+        self.emotion_worker = EmotionWorker(analysis_fps, detector_backend="skip")
+        # merged (reading status, emotion, time) samples, one per second
+        self.engagement_log = collections.deque(maxlen=DEFAULT_CAPACITY)
+        self.last_engagement_update = time.time()
+
+    @property
+    def emotion_log(self):
+        return self.emotion_worker.emotion_log
+
+    @property
+    def analysis_fps(self):
+        return self.emotion_worker.analysis_fps
+
+    def faces_located(self, img, faces):
+        if not faces:
+            self.emotion_worker.clear()
+            return
+        # the largest face is the student in front of the camera
+        face = max(faces, key=lambda f: f.area())
+        crop = crop_face(img, face)
+        if crop is not None:
+            self.emotion_worker.submit(crop)
+
+    def process(self, img):
+        faces = super().process(img)
+        emotion = self.emotion_worker.emotion
+
+        if time.time() - self.last_engagement_update >= 1:
+            self.engagement_log.append((
+                "Reading" if self.reading_status else "Not reading",
+                emotion or "no face",
+                time.strftime("%H:%M:%S"),
+            ))
+            self.last_engagement_update = time.time()
+            if self.store is not None:
+                face_seen = faces or time.time() - self.last_face_time < 2
+                self.store.record(
+                    self.user, self.session,
+                    self.reading_status if face_seen else None, emotion,
+                )
+        return faces
+
+    def draw_status(self, img):
+        super().draw_status(img)
+        emotion = self.emotion_worker.emotion
+        if emotion:
+            cv2.putText(img, f"Emotion: {emotion}", (10, 90),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+
+    def on_ended(self):
+        self.emotion_worker.stop()
@@ -0,0 +1,131 @@
+import time
+import threading
+import numpy as np
+
+# Fixed-capacity, array-backed log of (label, timestamp) samples. Labels are
+# stored as small integer codes and timestamps as epoch seconds; running counts
+# for the whole log and for the last 1/5/15 minutes are updated on append, so
+# percentages, distributions and windowed rates are O(1) reads.
+DEFAULT_CAPACITY = 4 * 3600
+WINDOWS = (60, 300, 900)
+
+
+class RingLog:
+    def __init__(self, labels=(), capacity=DEFAULT_CAPACITY, windows=WINDOWS):
+        self.capacity = capacity
+        self.windows = tuple(windows)
+        self.labels = list(labels)
+        self._codes = {label: i for i, label in enumerate(self.labels)}
+        self._label_codes = np.zeros(capacity, dtype=np.int16)
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._seq = 0  # number of samples ever appended
+            self._counts = np.zeros(max(len(self.labels), 1), dtype=np.int64)
+            # per window: sequence number of its oldest sample, and its counts
+            self._window_start = {w: 0 for w in self.windows}
+            self._window_counts = {w: np.zeros_like(self._counts) for w in self.windows}
+
+    def _code(self, label):
+        code = self._codes.get(label)
+        if code is None:
+            code = self._codes[label] = len(self.labels)
+            self.labels.append(label)
+            if code >= len(self._counts):
+                grow = len(self._counts)
+                self._counts = np.concatenate([self._counts, np.zeros(grow, dtype=np.int64)])
+                for w in self.windows:
+                    self._window_counts[w] = np.concatenate(
+                        [self._window_counts[w], np.zeros(grow, dtype=np.int64)]
+                    )
+        return code
+
+    def _expire(self, now, oldest=None):
+        # advance each window past samples that are too old or overwritten;
+        # every sample leaves each window once, so this is amortized O(1)
+        if oldest is None:
+            oldest = max(0, self._seq - self.capacity)
+        for w in self.windows:
+            start = self._window_start[w]
+            counts = self._window_counts[w]
+            while start < self._seq:
+                i = start % self.capacity
+                if start >= oldest and self._times[i] >= now - w:
+                    break
+                counts[self._label_codes[i]] -= 1
+                start += 1
+            self._window_start[w] = start
+
+    def append(self, label, t=None):
+        t = time.time() if t is None else t
+        with self._lock:
+            code = self._code(label)
+            i = self._seq % self.capacity
+            if self._seq >= self.capacity:
+                # the overwritten sample leaves the running totals, and the
+                # windows drop it before its slot is reused
+                self._counts[self._label_codes[i]] -= 1
+            self._expire(t, oldest=self._seq + 1 - self.capacity)
+            self._label_codes[i] = code
+            self._times[i] = t
+            self._seq += 1
+            self._counts[code] += 1
+            for w in self.windows:
+                self._window_counts[w][code] += 1
+
+    def __len__(self):
+        return min(self._seq, self.capacity)
+
+    def count(self, label=None):
+        with self._lock:
+            if label is None:
+                return len(self)
+            code = self._codes.get(label)
+            return 0 if code is None else int(self._counts[code])
+
+    def fraction(self, labels):
+        # share of samples carrying any of labels, 0.0 for an empty log
+        if isinstance(labels, str):
+            labels = (labels,)
+        total = len(self)
+        return sum(self.count(label) for label in labels) / total if total else 0.0
+
+    def distribution(self):
+        with self._lock:
+            return {
+                label: int(self._counts[code])
+                for label, code in self._codes.items()
+                if self._counts[code]
+            }
+
+    def window_distribution(self, window, now=None):
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+            counts = self._window_counts[window]
+            return {
+                label: int(counts[code]) for label, code in self._codes.items() if counts[code]
+            }
+
+    def window_fraction(self, labels, window, now=None):
+        if isinstance(labels, str):
+            labels = (labels,)
+        distribution = self.window_distribution(window, now)
+        total = sum(distribution.values())
+        return sum(distribution.get(label, 0) for label in labels) / total if total else 0.0
+
+    def window_rate(self, window, now=None):
+        # samples per minute over the window
+        return sum(self.window_distribution(window, now).values()) * 60 / window
+
+    def tail(self, n=10):
+        # last n samples as (label, "HH:MM:SS"), oldest first
+        with self._lock:
+            start = max(self._seq - min(n, self.capacity), 0)
+            return [
+                (self.labels[self._label_codes[s % self.capacity]],
+                 time.strftime("%H:%M:%S", time.localtime(self._times[s % self.capacity])))
+                for s in range(start, self._seq)
+            ]
@@ -0,0 +1,198 @@
+import os
+import time
+import queue
+import sqlite3
+import threading
+
+from emotion_service import EMOTION_LABELS
+
+# Durable per-second engagement samples (reading status, dominant emotion) per
+# user and session, in a local SQLite file. Samples are queued by the video
+# thread and written in batches by a background writer; raw samples older than
+# ENGAGEMENT_RAW_RETENTION are rolled up into per-minute rows. Both tables are
+# clustered on (user, time) so time-range queries for the charts are index scans.
+ENGAGEMENT_DB_PATH = os.environ.get("ENGAGEMENT_DB_PATH", "engagement.sqlite3")
+ENGAGEMENT_FLUSH_INTERVAL = float(os.environ.get("ENGAGEMENT_FLUSH_INTERVAL", "5"))
+ENGAGEMENT_FLUSH_SIZE = int(os.environ.get("ENGAGEMENT_FLUSH_SIZE", "500"))
+ENGAGEMENT_RAW_RETENTION = float(os.environ.get("ENGAGEMENT_RAW_RETENTION", str(7 * 24 * 3600)))
+ROLLUP_INTERVAL = 3600
+POSITIVE_EMOTIONS = ("happy", "neutral")
+
+_EMOTION_CODES = {label: i for i, label in enumerate(EMOTION_LABELS)}
+_POSITIVE_CODES = tuple(_EMOTION_CODES[label] for label in POSITIVE_EMOTIONS)
+
+
+class EngagementStore:
+    def __init__(self, path=ENGAGEMENT_DB_PATH, flush_interval=ENGAGEMENT_FLUSH_INTERVAL,
+                 flush_size=ENGAGEMENT_FLUSH_SIZE, raw_retention=ENGAGEMENT_RAW_RETENTION):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.raw_retention = raw_retention
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._init_db()
+        self._last_rollup = 0.0
+        self._writer = threading.Thread(target=self._write_loop, name="engagement-store", daemon=True)
+        self._writer.start()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        # reading: 1/0, emotion: index into EMOTION_LABELS, NULL when no face was seen
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS samples (
+                user TEXT NOT NULL,
+                ts REAL NOT NULL,
+                session TEXT NOT NULL,
+                reading INTEGER,
+                emotion INTEGER,
+                PRIMARY KEY (user, ts, session)
+            ) WITHOUT ROWID"""
+        )
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS samples_minute (
+                user TEXT NOT NULL,
+                minute INTEGER NOT NULL,
+                session TEXT NOT NULL,
+                samples INTEGER NOT NULL,
+                reading INTEGER NOT NULL,
+                positive INTEGER NOT NULL,
+                emotions INTEGER NOT NULL,
+                PRIMARY KEY (user, minute, session)
+            ) WITHOUT ROWID"""
+        )
+
+    def record(self, user, session, reading, emotion, ts=None):
+        # called from the video thread, never blocks on disk
+        self._queue.put((
+            user,
+            time.time() if ts is None else ts,
+            session,
+            None if reading is None else int(bool(reading)),
+            _EMOTION_CODES.get(emotion),
+        ))
+
+    def _write_loop(self):
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    # flush() marker: write what we have, then release the caller
+                    try:
+                        self._write(batch)
+                    except Exception as e:
+                        print(f"Error writing engagement samples: {e}")
+                    finally:
+                        batch = []
+                        item.set()
+                    continue
+                batch.append(item)
+            try:
+                self._write(batch)
+                if time.time() - self._last_rollup > ROLLUP_INTERVAL:
+                    self.rollup()
+            except Exception as e:
+                print(f"Error writing engagement samples: {e}")
+
+    def _write(self, batch):
+        if batch:
+            self._conn().executemany(
+                "INSERT OR REPLACE INTO samples (user, ts, session, reading, emotion) "
+                "VALUES (?, ?, ?, ?, ?)",
+                batch,
+            )
+
+    def flush(self, timeout=10):
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def rollup(self, now=None):
+        # downsample raw samples past the retention window into per-minute rows
+        cutoff = (time.time() if now is None else now) - self.raw_retention
+        conn = self._conn()
+        positive = ",".join(str(code) for code in _POSITIVE_CODES)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                f"""INSERT INTO samples_minute (user, minute, session, samples, reading, positive, emotions)
+                SELECT user, CAST(ts / 60 AS INTEGER) AS minute, session, COUNT(*),
+                       SUM(COALESCE(reading, 0)),
+                       SUM(CASE WHEN emotion IN ({positive}) THEN 1 ELSE 0 END),
+                       COUNT(emotion)
+                FROM samples WHERE ts < ? GROUP BY user, minute, session
+                ON CONFLICT (user, minute, session) DO UPDATE SET
+                    samples = samples + excluded.samples,
+                    reading = reading + excluded.reading,
+                    positive = positive + excluded.positive,
+                    emotions = emotions + excluded.emotions""",
+                (cutoff,),
+            )
+            conn.execute("DELETE FROM samples WHERE ts < ?", (cutoff,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._last_rollup = time.time()
+
+    def samples(self, user, start, end):
+        # raw samples as (ts, session, reading, emotion label)
+        rows = self._conn().execute(
+            "SELECT ts, session, reading, emotion FROM samples "
+            "WHERE user = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            (user, start, end),
+        )
+        return [
+            (ts, session, reading, None if emotion is None else EMOTION_LABELS[emotion])
+            for ts, session, reading, emotion in rows
+        ]
+
+    def minutes(self, user, start, end):
+        # per-minute (epoch minute start, reading %, positive emotion %, samples),
+        # combining rolled-up and raw data
+        positive = ",".join(str(code) for code in _POSITIVE_CODES)
+        rows = self._conn().execute(
+            f"""SELECT minute, SUM(samples), SUM(reading), SUM(positive), SUM(emotions) FROM (
+                SELECT minute, samples, reading, positive, emotions FROM samples_minute
+                WHERE user = ? AND minute >= ? AND minute < ?
+                UNION ALL
+                SELECT CAST(ts / 60 AS INTEGER), 1, COALESCE(reading, 0),
+                       CASE WHEN emotion IN ({positive}) THEN 1 ELSE 0 END,
+                       emotion IS NOT NULL
+                FROM samples WHERE user = ? AND ts >= ? AND ts < ?
+            ) GROUP BY minute ORDER BY minute""",
+            (user, int(start // 60), int(end // 60) + 1, user, start, end),
+        )
+        return [
+            (minute * 60, reading * 100 / samples, positive * 100 / emotions if emotions else 0.0, samples)
+            for minute, samples, reading, positive, emotions in rows
+        ]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EngagementStore()
+        return _store
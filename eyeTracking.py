@@ -1,122 +1,215 @@
+import os
 import cv2
-import dlib
-import numpy as np
 import time
 import av
 import streamlit as st
 from streamlit_webrtc import webrtc_streamer, VideoProcessorBase
 from streamlit.components.v1 import html
+import face_analysis
+from engagement_log import RingLog
+import warmup
+from governor import FrameGovernor
+from reading_classifier import READING_MAX_GAP, ReadingClassifier, gaze_point
+from metrics import VIDEO_FRAME_SECONDS, VIDEO_STAGE_SECONDS
 
-# Initialize dlib components
-detector = dlib.get_frontal_face_detector()
-predictor = dlib.shape_predictor("shape_predictor_68_face_landmarks.dat")
-
-# Constants
-LEFT_EYE_INDICES = list(range(36, 42))
-RIGHT_EYE_INDICES = list(range(42, 48))
+# Detect-once-then-track: the HOG detector runs every EYE_DETECT_EVERY frames
+# (or when tracking looks lost); in between, the face box is taken from the
+# previous frame's landmarks. EYE_DETECT_SCALE < 1 (opt-in) runs detection on a
+# downscaled frame.
+EYE_TRACKING = os.environ.get("EYE_TRACKING", "1") == "1"
+EYE_DETECT_EVERY = int(os.environ.get("EYE_DETECT_EVERY", "10"))
+EYE_DETECT_SCALE = float(os.environ.get("EYE_DETECT_SCALE", "1.0"))
+EYE_MIN_TRACK_IOU = float(os.environ.get("EYE_MIN_TRACK_IOU", "0.5"))
+# smallest combined downscale of the frame the detector sees, governor scale
+# times EYE_DETECT_SCALE; below it HOG misses faces at normal webcam distance
+EYE_MIN_DETECT_SCALE = float(os.environ.get("EYE_MIN_DETECT_SCALE", "0.5"))
+# Run frame analysis in a pool of worker processes (see frame_pool.py)
+EYE_PROCESS_POOL = os.environ.get("EYE_PROCESS_POOL", "0") == "1"
 
 class EyeProcessor(VideoProcessorBase):
-    def __init__(self):
+    # processor label of the video_frame_seconds metric
+    metrics_name = "eye"
+
+    def __init__(self, tracking=EYE_TRACKING, detect_every=EYE_DETECT_EVERY,
+                 detect_scale=EYE_DETECT_SCALE, min_track_iou=EYE_MIN_TRACK_IOU,
+                 use_pool=EYE_PROCESS_POOL, min_detect_scale=EYE_MIN_DETECT_SCALE):
         super().__init__()
-        self.prev_left_pupil = None
-        self.prev_right_pupil = None
+        # drops stale frames and lowers analysis resolution/rate under load
+        self.governor = FrameGovernor()
+        self.analysis_scale = 1.0
+        # windowed saccade/fixation classifier over the gaze trace; at the
+        # governor's lowest analysis rate samples are 1 / min_analysis_fps apart,
+        # which must not count as a gap
+        self.reading_classifier = ReadingClassifier(
+            max_gap=max(READING_MAX_GAP, 1.5 / self.governor.min_analysis_fps)
+        )
         self.reading_status = False
+        # presentation time in seconds of the frame being processed
+        self.frame_time = None
         self.last_update = time.time()
-        self.status_log = []
+        self.status_log = RingLog(["Reading", "Not reading"])
         self.last_face_time = time.time()
 
+        self.tracking = tracking
+        self.detect_every = detect_every
+        self.detect_scale = detect_scale
+        self.min_detect_scale = min_detect_scale
+        self.min_track_iou = min_track_iou
+        self.tracked_faces = []
+        self.frames_since_detection = 0
+        self.detections = 0
+        self.pool = None
+        if use_pool:
+            import frame_pool
+            self.pool = frame_pool.get_pool()
+        # exponential moving averages of processing time and frame rate
+        self.process_time = 0.0
+        self.fps = 0.0
+        self.last_frame_time = None
+        # seconds from creation to the first processed frame, includes loading
+        # the models unless they were warmed up
+        self.created = time.perf_counter()
+        self.first_frame_latency = None
+
+    def faces_to_track(self):
+        # boxes from the previous frame, or None when it's time for a full detection
+        if (self.tracking and self.tracked_faces
+                and self.frames_since_detection < self.detect_every):
+            return self.tracked_faces
+        return None
+
+    def record_faces(self, next_faces, detected):
+        self.tracked_faces = next_faces
+        if detected:
+            self.detections += 1
+            self.frames_since_detection = 0
+        else:
+            self.frames_since_detection += 1
+
+    def effective_detect_scale(self):
+        # detection scale within the analysed frame, raised so the governor's
+        # downscale and EYE_DETECT_SCALE together stay above min_detect_scale
+        return min(1.0, max(self.detect_scale, self.min_detect_scale / self.analysis_scale))
+
+    def locate_faces(self, gray):
+        # returns (face boxes, landmarks), detecting only when needed
+        faces, shapes, next_faces, detected = face_analysis.locate_faces(
+            gray, self.faces_to_track(), self.effective_detect_scale(), self.min_track_iou
+        )
+        self.record_faces(next_faces, detected)
+        return faces, shapes
+
+    def analyse(self, img):
+        # returns (face boxes, [(left eye, right eye)] per face) in img's
+        # coordinates, analysing a downscaled copy when the governor asks for it
+        scale = self.governor.scale
+        if scale != self.analysis_scale:
+            # tracked boxes are in the previous analysis resolution
+            self.tracked_faces = []
+            self.analysis_scale = scale
+        if scale >= 1:
+            return self.analyse_frame(img)
+        small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        faces, eyes = self.analyse_frame(small)
+        return ([face_analysis.scale_rect(face, 1 / scale) for face in faces],
+                face_analysis.scale_eyes(eyes, 1 / scale))
+
+    def analyse_frame(self, img):
+        if self.pool is not None:
+            with VIDEO_STAGE_SECONDS.time(stage="pool"):
+                faces, eyes, next_faces, detected = self.pool.analyse(
+                    img, self.faces_to_track(), self.effective_detect_scale(), self.min_track_iou
+                )
+            self.record_faces(next_faces, detected)
+            return faces, eyes
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        faces, shapes = self.locate_faces(gray)
+        return faces, face_analysis.find_eyes(img, shapes)
+
+    def update_fps(self, started):
+        now = time.time()
+        self.process_time = 0.9 * self.process_time + 0.1 * (now - started)
+        if self.last_frame_time is not None and now > self.last_frame_time:
+            self.fps = 0.9 * self.fps + 0.1 / (now - self.last_frame_time)
+        self.last_frame_time = now
+
     def get_eye_center(self, eye_points):
-        x = sum([p[0] for p in eye_points]) // len(eye_points)
-        y = sum([p[1] for p in eye_points]) // len(eye_points)
-        return (x, y)
+        return face_analysis.eye_center(eye_points)
 
     def get_pupil_position(self, eye_region, eye_center):
-        gray_eye = cv2.cvtColor(eye_region, cv2.COLOR_BGR2GRAY)
-        _, thresh = cv2.threshold(gray_eye, 50, 255, cv2.THRESH_BINARY_INV)
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if contours:
-            max_contour = max(contours, key=cv2.contourArea)
-            M = cv2.moments(max_contour)
-            if M["m00"] != 0:
-                cx = int(M["m10"] / M["m00"])
-                cy = int(M["m01"] / M["m00"])
-                return (eye_center[0] + cx, eye_center[1] + cy)
-        return eye_center
-
-    def is_reading(self, left_pupil, right_pupil, frame_width):
-        if not self.prev_left_pupil or not self.prev_right_pupil:
-            return False
-
-        left_h = abs(left_pupil[0] - self.prev_left_pupil[0])
-        left_v = abs(left_pupil[1] - self.prev_left_pupil[1])
-        right_h = abs(right_pupil[0] - self.prev_right_pupil[0])
-        right_v = abs(right_pupil[1] - self.prev_right_pupil[1])
-
-        avg_h = (left_h + right_h) / 2
-        avg_v = (left_v + right_v) / 2
-
-        return (2 <= avg_h <= frame_width // 10) and (avg_v <= 5)
+        return face_analysis.pupil_position(eye_region, eye_center)
 
-    def recv(self, frame: av.VideoFrame) -> av.VideoFrame:
-        img = frame.to_ndarray(format="bgr24")
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        faces = detector(gray)
+    def is_reading(self, left_eye, right_eye, timestamp):
+        # adds the (eye center, pupil) pairs seen at timestamp (seconds) to
+        # the classifier window and returns its verdict
+        return self.reading_classifier.update(timestamp, gaze_point(left_eye, right_eye))
+
+    def faces_located(self, img, faces):
+        # hook for subclasses that reuse the face boxes, called before anything is drawn on img
+        pass
+
+    def process(self, img):
+        faces, eyes = self.analyse(img)
+        self.faces_located(img, faces)
         
         if len(faces) > 0:
             self.last_face_time = time.time()
 
-        current_left_pupil = None
-        current_right_pupil = None
+        current_left_eye = None
+        current_right_eye = None
 
-        for face in faces:
-            landmarks = predictor(gray, face)
-            
-            # Left eye processing
-            left_eye_points = [(landmarks.part(i).x, landmarks.part(i).y) 
-                             for i in LEFT_EYE_INDICES]
-            left_center = self.get_eye_center(left_eye_points)
-            left_region = img[
-                max(0, left_center[1]-10):min(img.shape[0], left_center[1]+10),
-                max(0, left_center[0]-10):min(img.shape[1], left_center[0]+10)
-            ]
-            if left_region.size > 0:
-                left_pupil = self.get_pupil_position(left_region, left_center)
-                current_left_pupil = left_pupil
+        for left_eye, right_eye in eyes:
+            if left_eye:
+                current_left_eye = left_eye
+                left_center, left_pupil = left_eye
                 cv2.circle(img, left_center, 5, (0, 255, 0), -1)
                 cv2.circle(img, left_pupil, 3, (0, 0, 255), -1)
-
-            # Right eye processing
-            right_eye_points = [(landmarks.part(i).x, landmarks.part(i).y) 
-                              for i in RIGHT_EYE_INDICES]
-            right_center = self.get_eye_center(right_eye_points)
-            right_region = img[
-                max(0, right_center[1]-10):min(img.shape[0], right_center[1]+10),
-                max(0, right_center[0]-10):min(img.shape[1], right_center[0]+10)
-            ]
-            if right_region.size > 0:
-                right_pupil = self.get_pupil_position(right_region, right_center)
-                current_right_pupil = right_pupil
+            if right_eye:
+                current_right_eye = right_eye
+                right_center, right_pupil = right_eye
                 cv2.circle(img, right_center, 5, (0, 255, 0), -1)
                 cv2.circle(img, right_pupil, 3, (0, 0, 255), -1)
 
-        if current_left_pupil and current_right_pupil:
-            self.reading_status = self.is_reading(current_left_pupil, 
-                                                current_right_pupil, 
-                                                img.shape[1])
-            self.prev_left_pupil = current_left_pupil
-            self.prev_right_pupil = current_right_pupil
+        if current_left_eye and current_right_eye:
+            # the frame's own timestamp, the governor may skip frames in between
+            timestamp = self.frame_time if self.frame_time is not None else time.monotonic()
+            self.reading_status = self.is_reading(current_left_eye, current_right_eye, timestamp)
 
             if time.time() - self.last_update >= 1:
                 self.status_log.append(
-                    ("Reading" if self.reading_status else "Not reading", 
-                     time.strftime("%H:%M:%S")))
+                    "Reading" if self.reading_status else "Not reading")
                 self.last_update = time.time()
 
+        self.draw_status(img)
+        return faces
+
+    def draw_status(self, img):
+        # overlay of the latest results, also drawn on frames the governor skipped
         color = (0, 255, 0) if self.reading_status else (0, 0, 255)
         cv2.putText(img, f"Reading: {'YES' if self.reading_status else 'NO'}", 
                    (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-        
-        return av.VideoFrame.from_ndarray(img, format="bgr24")
+
+    def recv(self, frame: av.VideoFrame) -> av.VideoFrame:
+        with VIDEO_FRAME_SECONDS.time(processor=self.metrics_name):
+            started = time.time()
+            with VIDEO_STAGE_SECONDS.time(stage="decode"):
+                img = frame.to_ndarray(format="bgr24")
+            if self.governor.admit(frame.time):
+                analysis_started = time.perf_counter()
+                self.frame_time = frame.time
+                self.process(img)
+                self.governor.record(time.perf_counter() - analysis_started)
+            else:
+                self.draw_status(img)
+            self.update_fps(started)
+            if self.first_frame_latency is None:
+                self.first_frame_latency = time.perf_counter() - self.created
+                warmup.record("first_frame", self.first_frame_latency)
+            cv2.putText(img, f"{self.fps:.1f} fps", (10, 60),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+
+            with VIDEO_STAGE_SECONDS.time(stage="encode"):
+                return av.VideoFrame.from_ndarray(img, format="bgr24")
 
 def main():
     st.title("Real-time Reading Detection 👁️")
@@ -140,12 +233,12 @@ def main():
     if ctx.video_processor:
         st.subheader("Reading Status Log")
         if st.button("Clear Log"):
-            ctx.video_processor.status_log = []
+            ctx.video_processor.status_log.clear()
         
-        if ctx.video_processor.status_log:
+        if len(ctx.video_processor.status_log):
             log_text = "\n".join(
                 [f"{status[1]} - {status[0]}" 
-                 for status in ctx.video_processor.status_log[-10:]]
+                 for status in ctx.video_processor.status_log.tail(10)]
             )
             st.text_area("Log", value=log_text, height=200, key="log_display")
         
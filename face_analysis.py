@@ -0,0 +1,158 @@
+import time
+import threading
+import cv2
+import dlib
+from metrics import VIDEO_STAGE_SECONDS
+
+# Frame analysis shared by EyeProcessor and the frame_pool worker processes.
+# Only cv2, dlib and metrics are imported here so worker processes stay light.
+# The dlib models are loaded on first use (or by load_models()), so importing
+# this module is cheap.
+SHAPE_PREDICTOR_PATH = "shape_predictor_68_face_landmarks.dat"
+
+_models = None
+_models_lock = threading.Lock()
+# seconds it took to load the models in this process, None until loaded
+model_load_time = None
+
+# Constants
+LEFT_EYE_INDICES = list(range(36, 42))
+RIGHT_EYE_INDICES = list(range(42, 48))
+TRACK_MARGIN = 0.2
+EYE_REGION_RADIUS = 10
+
+_detect_timer = VIDEO_STAGE_SECONDS.labels(stage="detect")
+_landmarks_timer = VIDEO_STAGE_SECONDS.labels(stage="landmarks")
+_pupil_timer = VIDEO_STAGE_SECONDS.labels(stage="pupil")
+
+
+def load_models():
+    # (HOG face detector, 68-point landmark predictor)
+    global _models, model_load_time
+    if _models is None:
+        with _models_lock:
+            if _models is None:
+                started = time.perf_counter()
+                models = (dlib.get_frontal_face_detector(), dlib.shape_predictor(SHAPE_PREDICTOR_PATH))
+                model_load_time = time.perf_counter() - started
+                _models = models
+    return _models
+
+
+def rect_iou(a, b):
+    left, top = max(a.left(), b.left()), max(a.top(), b.top())
+    right, bottom = min(a.right(), b.right()), min(a.bottom(), b.bottom())
+    inter = max(0, right - left) * max(0, bottom - top)
+    union = a.area() + b.area() - inter
+    return inter / union if union > 0 else 0.0
+
+
+def landmarks_rect(landmarks, width, height, margin=TRACK_MARGIN):
+    # box around the 68 landmarks, grown by margin so the next frame's face still fits
+    xs = [landmarks.part(i).x for i in range(landmarks.num_parts)]
+    ys = [landmarks.part(i).y for i in range(landmarks.num_parts)]
+    pad_x = int((max(xs) - min(xs)) * margin)
+    pad_y = int((max(ys) - min(ys)) * margin)
+    return dlib.rectangle(
+        max(0, min(xs) - pad_x),
+        max(0, min(ys) - pad_y),
+        min(width - 1, max(xs) + pad_x),
+        min(height - 1, max(ys) + pad_y),
+    )
+
+
+def scale_rect(rect, factor):
+    return dlib.rectangle(int(rect.left() * factor), int(rect.top() * factor),
+                          int(rect.right() * factor), int(rect.bottom() * factor))
+
+
+def scale_point(point, factor):
+    return (int(point[0] * factor), int(point[1] * factor))
+
+
+def scale_eyes(eyes, factor):
+    # find_eyes results of a resized frame, mapped back by factor
+    return [
+        tuple(
+            None if eye is None else (scale_point(eye[0], factor), scale_point(eye[1], factor))
+            for eye in pair
+        )
+        for pair in eyes
+    ]
+
+
+def detect_faces(gray, detect_scale=1.0):
+    detector = load_models()[0]
+    with _detect_timer.time():
+        if detect_scale >= 1:
+            return list(detector(gray))
+        small = cv2.resize(gray, None, fx=detect_scale, fy=detect_scale,
+                           interpolation=cv2.INTER_AREA)
+        return [scale_rect(face, 1 / detect_scale) for face in detector(small)]
+
+
+def fit_landmarks(gray, faces):
+    predictor = load_models()[1]
+    with _landmarks_timer.time():
+        return [predictor(gray, face) for face in faces]
+
+
+def locate_faces(gray, tracked_faces=None, detect_scale=1.0, min_track_iou=0.5):
+    # Returns (faces, landmarks, boxes to track next frame, whether the detector ran).
+    # With tracked_faces the landmarks are fitted in those boxes and the detector
+    # only runs if the landmarks drifted away from them.
+    height, width = gray.shape[:2]
+    detected = not tracked_faces
+    faces = detect_faces(gray, detect_scale) if detected else tracked_faces
+    shapes = fit_landmarks(gray, faces)
+    next_faces = [landmarks_rect(shape, width, height) for shape in shapes]
+
+    if not detected and any(rect_iou(a, b) < min_track_iou for a, b in zip(faces, next_faces)):
+        detected = True
+        faces = detect_faces(gray, detect_scale)
+        shapes = fit_landmarks(gray, faces)
+        next_faces = [landmarks_rect(shape, width, height) for shape in shapes]
+
+    return faces, shapes, next_faces, detected
+
+
+def eye_center(eye_points):
+    x = sum([p[0] for p in eye_points]) // len(eye_points)
+    y = sum([p[1] for p in eye_points]) // len(eye_points)
+    return (x, y)
+
+
+def pupil_position(eye_region, center):
+    gray_eye = cv2.cvtColor(eye_region, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray_eye, 50, 255, cv2.THRESH_BINARY_INV)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if contours:
+        max_contour = max(contours, key=cv2.contourArea)
+        M = cv2.moments(max_contour)
+        if M["m00"] != 0:
+            cx = int(M["m10"] / M["m00"])
+            cy = int(M["m01"] / M["m00"])
+            return (center[0] + cx, center[1] + cy)
+    return center
+
+
+def find_eye(img, landmarks, indices):
+    # (eye center, pupil) for one eye, or None if the eye region is outside the frame
+    points = [(landmarks.part(i).x, landmarks.part(i).y) for i in indices]
+    center = eye_center(points)
+    region = img[
+        max(0, center[1] - EYE_REGION_RADIUS):min(img.shape[0], center[1] + EYE_REGION_RADIUS),
+        max(0, center[0] - EYE_REGION_RADIUS):min(img.shape[1], center[0] + EYE_REGION_RADIUS)
+    ]
+    if region.size == 0:
+        return None
+    return center, pupil_position(region, center)
+
+
+def find_eyes(img, shapes):
+    # [(left eye, right eye)] per face, see find_eye
+    with _pupil_timer.time():
+        return [
+            (find_eye(img, landmarks, LEFT_EYE_INDICES), find_eye(img, landmarks, RIGHT_EYE_INDICES))
+            for landmarks in shapes
+        ]
@@ -0,0 +1,139 @@
+import os
+import queue
+import atexit
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+import dlib
+import numpy as np
+
+# Offloads EyeProcessor's frame analysis (detector, landmark predictor, pupil
+# search) to a pool of worker processes so concurrent sessions aren't bound to
+# one GIL. Each worker loads the dlib models once when it starts.
+# Frames are copied into pre-allocated shared memory slots; only the slot name
+# and a few face boxes are pickled per frame.
+FRAME_POOL_WORKERS = int(os.environ.get("FRAME_POOL_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+FRAME_POOL_MAX_FRAME_BYTES = int(os.environ.get("FRAME_POOL_MAX_FRAME_BYTES", str(1920 * 1080 * 3)))
+
+
+def _to_box(rect):
+    return (rect.left(), rect.top(), rect.right(), rect.bottom())
+
+
+def _to_rect(box):
+    return dlib.rectangle(*box)
+
+
+# worker process side
+_attached = {}
+
+
+def _init_worker():
+    import face_analysis
+    face_analysis.load_models()  # once per worker, before its first frame
+
+
+def _frame(name, shape, dtype):
+    shm = _attached.get(name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            from multiprocessing import resource_tracker
+
+            # the parent owns the block, don't let this process's tracker
+            # unlink it; POSIX blocks are registered under "/" + name, Windows
+            # has no tracker
+            resource_tracker.unregister("/" + shm.name, "shared_memory")
+        _attached[name] = shm
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _analyse(name, shape, dtype, tracked_boxes, detect_scale, min_track_iou):
+    import cv2
+    import face_analysis
+
+    img = _frame(name, shape, dtype)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    tracked = [_to_rect(box) for box in tracked_boxes] if tracked_boxes else None
+    faces, shapes, next_faces, detected = face_analysis.locate_faces(
+        gray, tracked, detect_scale, min_track_iou
+    )
+    eyes = face_analysis.find_eyes(img, shapes)
+    return (
+        [_to_box(face) for face in faces],
+        eyes,
+        [_to_box(face) for face in next_faces],
+        detected,
+    )
+
+
+class FramePool:
+    def __init__(self, workers=FRAME_POOL_WORKERS, max_frame_bytes=FRAME_POOL_MAX_FRAME_BYTES):
+        self.workers = workers
+        self.max_frame_bytes = max_frame_bytes
+        # spawn, forking the Streamlit server with its threads is unsafe
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+        # two slots per worker so a frame can be copied in while another is analysed
+        self.slots = [
+            shared_memory.SharedMemory(create=True, size=max_frame_bytes)
+            for _ in range(workers * 2)
+        ]
+        self.free = queue.Queue()
+        for i in range(len(self.slots)):
+            self.free.put(i)
+
+    def analyse(self, img, tracked_faces, detect_scale, min_track_iou):
+        # same result as face_analysis.locate_faces + find_eyes, minus the landmarks:
+        # (faces, eyes, boxes to track next frame, whether the detector ran)
+        if img.nbytes > self.max_frame_bytes:
+            # doesn't fit a slot, analyse it in this process
+            return self._analyse_here(img, tracked_faces, detect_scale, min_track_iou)
+        i = self.free.get()
+        try:
+            shm = self.slots[i]
+            np.ndarray(img.shape, dtype=img.dtype, buffer=shm.buf)[:] = img
+            tracked_boxes = [_to_box(face) for face in tracked_faces] if tracked_faces else None
+            faces, eyes, next_faces, detected = self.executor.submit(
+                _analyse, shm.name, img.shape, img.dtype.str,
+                tracked_boxes, detect_scale, min_track_iou,
+            ).result()
+        finally:
+            self.free.put(i)
+        return [_to_rect(box) for box in faces], eyes, [_to_rect(box) for box in next_faces], detected
+
+    def _analyse_here(self, img, tracked_faces, detect_scale, min_track_iou):
+        import cv2
+        import face_analysis
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        faces, shapes, next_faces, detected = face_analysis.locate_faces(
+            gray, tracked_faces, detect_scale, min_track_iou
+        )
+        return faces, face_analysis.find_eyes(img, shapes), next_faces, detected
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for shm in self.slots:
+            shm.close()
+            shm.unlink()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # one pool per Streamlit server, shared by all sessions
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = FramePool()
+            # stops the workers and unlinks the shared memory slots
+            atexit.register(_pool.close)
+        return _pool
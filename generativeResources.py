@@ -1,46 +1,51 @@
 # genrative Resources py
-"""
-Install the Google AI Python SDK
+import json
+import llm
 
-$ pip install google-generativeai
 
-See the getting started guide for more information:
-https://ai.google.dev/gemini-api/docs/get-started/python
-"""
+GENERATION_CONFIG = llm.generation_config(
+    max_output_tokens=8192, response_mime_type="text/plain"
+)
 
-import os
-import json
+# safety_settings = Adjust safety settings
+# See https://ai.google.dev/gemini-api/docs/safety-settings
+SYSTEM_INSTRUCTION = "You are an AI tutor. Maintain a modest and calm language suitable for learning. You need to provide content to user to learn in given time."
 
-import google.generativeai as genai
 
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+def resource_prompt(course, knowledge_level, description, time):
+    return f"I am learning {course}. My knowledge level in this topic is {knowledge_level}. i want to {description}. I want to learn it in {time}. Teach me."
 
 
 def generate_resources(course, knowledge_level, description, time):
-    # Create the model
-    # See https://ai.google.dev/api/python/google/generativeai/GenerativeModel
-    generation_config = {
-        "temperature": 1,
-        "top_p": 0.95,
-        "top_k": 64,
-        "max_output_tokens": 8192,
-        "response_mime_type": "text/plain",
-    }
-
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        generation_config=generation_config,
-        # safety_settings = Adjust safety settings
-        # See https://ai.google.dev/gemini-api/docs/safety-settings
-        system_instruction="You are an AI tutor. Maintain a modest and calm language suitable for learning. You need to provide content to user to learn in given time.",
+    response_text = llm.generate(
+        "generate-resource",
+        resource_prompt(course, knowledge_level, description, time),
+        system_instruction=SYSTEM_INSTRUCTION,
+        generation_config=GENERATION_CONFIG,
     )
 
-    chat_session = model.start_chat(history=[])
+    print(response_text)
+    return json.dumps({"content": response_text})
+
 
-    response = chat_session.send_message(
-        f"I am learning {course}. My knowledge level in this topic is {knowledge_level}. i want to {description}. I want to learn it in {time}. Teach me.",
-        stream=False,
+def stream_resources(course, knowledge_level, description, time):
+    # yields markdown chunks as Gemini produces them
+    yield from llm.stream(
+        "generate-resource",
+        resource_prompt(course, knowledge_level, description, time),
+        system_instruction=SYSTEM_INSTRUCTION,
+        generation_config=GENERATION_CONFIG,
     )
 
-    print(response.text)
-    return json.dumps({"content": response.text})
+
+def fake_resources(prompt, generation_config):
+    rng = llm.fake_rng(prompt)
+    sections = []
+    for i in range(1, rng.randint(3, 6) + 1):
+        sections.append(
+            f"## Section {i}\n\n" + " ".join(["Lorem ipsum dolor sit amet."] * rng.randint(5, 20))
+        )
+    return "\n\n".join(sections)
+
+
+llm.register_fake("generate-resource", fake_resources)
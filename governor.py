@@ -0,0 +1,144 @@
+import os
+import time
+import threading
+
+# Keeps a video processor within its latency budget. The governor tracks the
+# processing time per analysed frame (exponential moving average) and, about
+# once a second, degrades or restores quality:
+#
+# - frames that arrive more than GOVERNOR_MAX_LAG_MS behind the camera clock
+#   are passed through without analysis (stale frames),
+# - while frames take longer than the target, the analysis resolution steps
+#   down to GOVERNOR_MIN_SCALE,
+# - if that isn't enough, frames are analysed only as often as the budget
+#   allows, never less than GOVERNOR_MIN_ANALYSIS_FPS,
+# - once frames are well under the target, the rate and then the resolution
+#   are restored.
+GOVERNOR_ENABLED = os.environ.get("GOVERNOR_ENABLED", "1") == "1"
+GOVERNOR_TARGET_MS = float(os.environ.get("GOVERNOR_TARGET_MS", "50"))
+GOVERNOR_MIN_SCALE = float(os.environ.get("GOVERNOR_MIN_SCALE", "0.5"))
+GOVERNOR_MIN_ANALYSIS_FPS = float(os.environ.get("GOVERNOR_MIN_ANALYSIS_FPS", "2"))
+GOVERNOR_MAX_LAG_MS = float(os.environ.get("GOVERNOR_MAX_LAG_MS", "500"))
+
+SCALE_STEP = 0.75
+RATE_STEP = 1.5
+ADJUST_INTERVAL = 1.0
+# restore quality only when well under the target, so it doesn't oscillate
+RESTORE_BELOW = 0.6
+# share of wall time analysis may take once the rate is limited
+MAX_UTILIZATION = 0.7
+# frames stale for this long mean the timestamps jumped (e.g. the stream was
+# restarted), not that we're behind, so the clock offset is measured again
+STALE_RESET = 2.0
+
+
+class FrameGovernor:
+    def __init__(self, target_latency=GOVERNOR_TARGET_MS / 1000, min_scale=GOVERNOR_MIN_SCALE,
+                 min_analysis_fps=GOVERNOR_MIN_ANALYSIS_FPS, max_lag=GOVERNOR_MAX_LAG_MS / 1000,
+                 enabled=GOVERNOR_ENABLED):
+        self.target_latency = target_latency
+        self.min_scale = min_scale
+        self.min_analysis_fps = min_analysis_fps
+        self.max_lag = max_lag
+        self.enabled = enabled
+
+        self.scale = 1.0
+        # None: every admitted frame is analysed
+        self.analysis_fps = None
+        self.processing_time = 0.0
+        self.analysed = 0
+        self.dropped_stale = 0
+        self.skipped = 0
+
+        self._clock_offset = None
+        self._stale_since = None
+        self._last_analysis = None
+        self._last_adjust = time.monotonic()
+        self._lock = threading.Lock()
+
+    def lag(self, frame_time, now):
+        # how far a frame is behind the camera clock; the smallest offset seen
+        # between wall clock and frame timestamps is taken as zero lag
+        if frame_time is None:
+            return 0.0
+        offset = now - frame_time
+        if self._clock_offset is None or offset < self._clock_offset:
+            self._clock_offset = offset
+        return offset - self._clock_offset
+
+    def admit(self, frame_time=None):
+        # True if this frame should be analysed, frame_time is the frame's
+        # timestamp in seconds (av.VideoFrame.time)
+        if not self.enabled:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if self.lag(frame_time, now) > self.max_lag:
+                if self._stale_since is None:
+                    self._stale_since = now
+                if now - self._stale_since < STALE_RESET:
+                    self.dropped_stale += 1
+                    return False
+                self._clock_offset = now - frame_time
+            self._stale_since = None
+            if (self.analysis_fps and self._last_analysis is not None
+                    and now - self._last_analysis < 1 / self.analysis_fps):
+                self.skipped += 1
+                return False
+            self._last_analysis = now
+            return True
+
+    def record(self, seconds):
+        # processing time of an analysed frame
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self.analysed += 1
+            if self.analysed == 1:
+                self.processing_time = seconds
+            else:
+                self.processing_time = 0.7 * self.processing_time + 0.3 * seconds
+            if now - self._last_adjust >= ADJUST_INTERVAL:
+                self._last_adjust = now
+                self._adjust()
+
+    def _adjust(self):
+        if self.processing_time > self.target_latency:
+            if self.scale > self.min_scale:
+                self.scale = max(self.min_scale, self.scale * SCALE_STEP)
+            else:
+                budget_fps = MAX_UTILIZATION / self.processing_time
+                current = self.analysis_fps or budget_fps
+                self.analysis_fps = max(self.min_analysis_fps, min(current, budget_fps))
+        elif self.processing_time < self.target_latency * RESTORE_BELOW:
+            if self.analysis_fps:
+                self.analysis_fps *= RATE_STEP
+                if self.analysis_fps >= MAX_UTILIZATION / self.processing_time:
+                    self.analysis_fps = None
+            elif self.scale < 1.0:
+                self.scale = min(1.0, self.scale / SCALE_STEP)
+
+    @property
+    def mode(self):
+        if not self.enabled:
+            return "off"
+        parts = []
+        if self.scale < 1.0:
+            parts.append(f"{self.scale:.0%} resolution")
+        if self.analysis_fps:
+            parts.append(f"analysing {self.analysis_fps:.1f} fps")
+        return ", ".join(parts) or "full quality"
+
+    def status(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "scale": self.scale,
+                "analysis_fps": self.analysis_fps,
+                "processing_ms": self.processing_time * 1000,
+                "target_ms": self.target_latency * 1000,
+                "analysed": self.analysed,
+                "dropped_stale": self.dropped_stale,
+                "skipped": self.skipped,
+            }
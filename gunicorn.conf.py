@@ -0,0 +1,18 @@
+# gunicorn config for running several API worker processes
+#   gunicorn -c gunicorn.conf.py base:api
+# Each worker applies its own AdmissionControl limits (see serving.py), so the
+# total capacity is SERVER_WORKERS * SERVER_MAX_ACTIVE. Point RESPONSE_CACHE_PATH
+# at a shared file so workers share generated responses.
+import os
+
+import serving
+
+bind = f"{serving.HOST}:{serving.PORT}"
+workers = int(os.environ.get("SERVER_WORKERS", "2"))
+worker_class = "gthread"
+# queued requests wait inside AdmissionControl, each on its own thread
+threads = serving.server_threads()
+backlog = 2048
+timeout = 180
+graceful_timeout = int(serving.SERVER_SHUTDOWN_GRACE)
+keepalive = 5
@@ -0,0 +1,75 @@
+# jsonstream py
+"""
+Incremental parsing of a JSON array inside a streamed JSON object.
+
+ArrayItemParser is fed the response text chunk by chunk and returns every
+element of the array under `key` as soon as that element is closed, so the
+first quiz question can be shown while the rest of the quiz is still being
+generated. Only the characters of the element being read are buffered.
+"""
+
+import json
+
+
+class ArrayItemParser:
+    def __init__(self, key):
+        self.key = key
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key_chars = None
+        self._last_key = None
+        self._array_depth = None
+        self._item = None
+
+    def feed(self, chunk):
+        items = []
+        for ch in chunk:
+            if self._item is not None:
+                self._item.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._last_key = "".join(self._key_chars)
+                        self._key_chars = None
+                    continue
+                if self._key_chars is not None:
+                    self._key_chars.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                # only strings directly inside the top-level object can be our key
+                in_top_object = self._depth == 1 and self._array_depth is None
+                self._key_chars = [] if in_top_object and not self.done else None
+            elif ch == "{" or ch == "[":
+                self._depth += 1
+                if (ch == "[" and self._depth == 2 and not self.done
+                        and self._array_depth is None and self._last_key == self.key):
+                    self._array_depth = self._depth
+                elif (self._array_depth is not None and self._item is None
+                        and self._depth == self._array_depth + 1):
+                    self._item = [ch]
+            elif ch == "}" or ch == "]":
+                if self._item is not None and self._depth == self._array_depth + 1:
+                    text = "".join(self._item)
+                    self._item = None
+                    try:
+                        items.append(json.loads(text))
+                    except ValueError:
+                        pass
+                elif self._array_depth is not None and self._depth == self._array_depth:
+                    self._array_depth = None
+                    self.done = True
+                self._depth -= 1
+            elif ch == ",":
+                if self._depth == 1:
+                    self._last_key = None
+        return items
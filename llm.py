@@ -0,0 +1,363 @@
+# llm py
+"""
+Shared gateway for every Gemini call made by the API.
+
+Configured model instances are built once per (model, generation config,
+safety settings, system instruction) and reused. Timeouts, retries with
+backoff for transient failures (timeouts, rate limits, server and connection
+errors) and the cap on concurrent upstream calls are applied here, and the
+backend can be swapped with LLM_BACKEND:
+
+- "gemini" (default): google.generativeai
+- "fake": deterministic local responses with configurable latency, token
+  rate and error rate, for load tests and benchmarks without network access
+"""
+
+import os
+import re
+import json
+import time
+import random
+import contextlib
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+from metrics import LLM_CALL_SECONDS, LLM_FIRST_CHUNK_SECONDS, LLM_PROMPT_TOKENS, LLM_OUTPUT_TOKENS
+
+
+load_dotenv()
+
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "gemini")
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "120"))
+LLM_RETRIES = int(os.environ.get("LLM_RETRIES", "3"))
+LLM_BACKOFF = float(os.environ.get("LLM_BACKOFF", "1.0"))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+FAKE_LLM_LATENCY = float(os.environ.get("FAKE_LLM_LATENCY", "0.5"))
+# output tokens per second of the fake backend, 0 for no generation time
+FAKE_LLM_TOKEN_RATE = float(os.environ.get("FAKE_LLM_TOKEN_RATE", "0"))
+# share of fake calls that fail, to exercise retries and error handling
+FAKE_LLM_ERROR_RATE = float(os.environ.get("FAKE_LLM_ERROR_RATE", "0"))
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+# upstream HTTP statuses worth retrying: timeouts, rate limits, server errors
+TRANSIENT_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+]
+
+
+def generation_config(max_output_tokens=8192, response_mime_type="application/json"):
+    # See https://ai.google.dev/api/python/google/generativeai/GenerativeModel
+    return {
+        "temperature": 1,
+        "top_p": 0.95,
+        "top_k": 64,
+        "max_output_tokens": max_output_tokens,
+        "response_mime_type": response_mime_type,
+    }
+
+
+def record_tokens(task, prompt_tokens, output_tokens):
+    if prompt_tokens is not None:
+        LLM_PROMPT_TOKENS.observe(prompt_tokens, task=task)
+    if output_tokens is not None:
+        LLM_OUTPUT_TOKENS.observe(output_tokens, task=task)
+
+
+def estimate_tokens(text):
+    # roughly four characters per token, like Gemini's tokenizer on English
+    return len(text) // 4
+
+
+def _record_usage(task, usage):
+    if usage is not None:
+        record_tokens(task, getattr(usage, "prompt_token_count", None),
+                      getattr(usage, "candidates_token_count", None))
+
+
+class GeminiBackend:
+    name = "gemini"
+
+    def __init__(self):
+        import google.generativeai as genai
+        from google.api_core import exceptions
+
+        genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+        self._genai = genai
+        self._api_errors = exceptions
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def model(self, model_name, generation_config, safety_settings, system_instruction):
+        key = json.dumps(
+            [model_name, generation_config, safety_settings, system_instruction],
+            sort_keys=True,
+        )
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self._genai.GenerativeModel(
+                    model_name=model_name,
+                    safety_settings=safety_settings,
+                    generation_config=generation_config,
+                    system_instruction=system_instruction,
+                )
+                self._models[key] = model
+        return model
+
+    def generate(self, task, prompt, model_name, generation_config, safety_settings,
+                 system_instruction, timeout):
+        model = self.model(model_name, generation_config, safety_settings, system_instruction)
+        response = model.generate_content(prompt, request_options={"timeout": timeout})
+        _record_usage(task, getattr(response, "usage_metadata", None))
+        return response.text
+
+    def stream(self, task, prompt, model_name, generation_config, safety_settings,
+               system_instruction, timeout):
+        model = self.model(model_name, generation_config, safety_settings, system_instruction)
+        response = model.generate_content(
+            prompt, stream=True, request_options={"timeout": timeout}
+        )
+        usage = None
+        for chunk in response:
+            # the running totals arrive with the chunks, the last ones are final
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            if chunk.text:
+                yield chunk.text
+        _record_usage(task, usage)
+
+    def retryable(self, error):
+        # invalid keys, bad requests and blocked responses (response.text
+        # raises ValueError) fail the same way every time
+        if isinstance(error, (TimeoutError, ConnectionError)):
+            return True
+        if isinstance(error, self._api_errors.GoogleAPICallError):
+            return error.code in TRANSIENT_STATUS
+        return False
+
+
+# task name -> function(prompt, generation_config) returning the fake response text
+_fake_responders = {}
+
+
+def register_fake(task, responder):
+    _fake_responders[task] = responder
+
+
+class FakeLLMError(RuntimeError):
+    pass
+
+
+class FakeBackend:
+    name = "fake"
+
+    def __init__(self, latency=FAKE_LLM_LATENCY, token_rate=FAKE_LLM_TOKEN_RATE,
+                 error_rate=FAKE_LLM_ERROR_RATE):
+        # latency is the time to the first token, token_rate then paces the output
+        self.latency = latency
+        self.token_rate = token_rate
+        self.error_rate = error_rate
+
+    def respond(self, task, prompt, generation_config):
+        responder = _fake_responders.get(task)
+        if responder is None:
+            return f"Fake response for {task}: {prompt}"
+        return responder(prompt, generation_config)
+
+    def generation_time(self, text):
+        # token counts of the fake backend are estimates, see estimate_tokens
+        return estimate_tokens(text) / self.token_rate if self.token_rate else 0.0
+
+    def retryable(self, error):
+        return isinstance(error, (FakeLLMError, TimeoutError, ConnectionError))
+
+    def maybe_fail(self, task):
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeLLMError(f"simulated upstream failure for {task}")
+
+    def generate(self, task, prompt, model_name, generation_config, safety_settings,
+                 system_instruction, timeout):
+        if self.latency:
+            time.sleep(self.latency)
+        self.maybe_fail(task)
+        text = self.respond(task, prompt, generation_config)
+        delay = self.generation_time(text)
+        if delay:
+            time.sleep(delay)
+        record_tokens(task, estimate_tokens(prompt), estimate_tokens(text))
+        return text
+
+    def stream(self, task, prompt, model_name, generation_config, safety_settings,
+               system_instruction, timeout, chunk_size=200):
+        text = self.respond(task, prompt, generation_config)
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)] or [""]
+        if self.token_rate:
+            if self.latency:
+                time.sleep(self.latency)
+            self.maybe_fail(task)
+            for chunk in chunks:
+                time.sleep(self.generation_time(chunk))
+                yield chunk
+        else:
+            # without a token rate the latency is spread over the chunks so
+            # the first one arrives early
+            self.maybe_fail(task)
+            for chunk in chunks:
+                if self.latency:
+                    time.sleep(self.latency / len(chunks))
+                yield chunk
+        record_tokens(task, estimate_tokens(prompt), estimate_tokens(text))
+
+
+def fake_rng(prompt):
+    # same prompt, same fake output
+    return random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+
+
+def prompt_weeks(prompt, default=4):
+    match = re.search(r"(\d+)\s*week", prompt)
+    return int(match.group(1)) if match else default
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "fake": FakeBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+_upstream_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _upstream_slot():
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+    try:
+        with _upstream_slots:
+            yield
+    finally:
+        with _in_flight_lock:
+            _in_flight -= 1
+
+
+def in_flight():
+    # upstream calls running or waiting for a slot in this process
+    return _in_flight
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = BACKENDS[LLM_BACKEND]()
+        return _backend
+
+
+def set_backend(backend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def generate(task, prompt, system_instruction, generation_config,
+             safety_settings=None, model_name=DEFAULT_MODEL,
+             timeout=LLM_TIMEOUT, retries=LLM_RETRIES):
+    backend = get_backend()
+    attempt = 0
+    while True:
+        try:
+            with _upstream_slot():
+                # timed from getting the slot, so the histogram shows the upstream round trip
+                started = time.perf_counter()
+                outcome = "error"
+                try:
+                    text = backend.generate(
+                        task,
+                        prompt,
+                        model_name=model_name,
+                        generation_config=generation_config,
+                        safety_settings=safety_settings,
+                        system_instruction=system_instruction,
+                        timeout=timeout,
+                    )
+                    outcome = "ok"
+                    return text
+                finally:
+                    LLM_CALL_SECONDS.observe(time.perf_counter() - started,
+                                             task=task, call="generate", outcome=outcome)
+        except Exception as e:
+            attempt += 1
+            if attempt > retries or not backend.retryable(e):
+                raise
+            delay = LLM_BACKOFF * (2 ** (attempt - 1)) * (1 + random.random())
+            print(f"{task} generation failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def stream(task, prompt, system_instruction, generation_config,
+           safety_settings=None, model_name=DEFAULT_MODEL,
+           timeout=LLM_TIMEOUT, retries=LLM_RETRIES):
+    # retries only happen before the first chunk, after that the caller has
+    # already forwarded partial output and a failure is raised as is
+    backend = get_backend()
+    attempt = 0
+    while True:
+        started = False
+        try:
+            with _upstream_slot():
+                call_started = time.perf_counter()
+                outcome = "error"
+                try:
+                    for chunk in backend.stream(
+                        task,
+                        prompt,
+                        model_name=model_name,
+                        generation_config=generation_config,
+                        safety_settings=safety_settings,
+                        system_instruction=system_instruction,
+                        timeout=timeout,
+                    ):
+                        if not started:
+                            started = True
+                            LLM_FIRST_CHUNK_SECONDS.observe(
+                                time.perf_counter() - call_started, task=task
+                            )
+                        yield chunk
+                    outcome = "ok"
+                except GeneratorExit:
+                    # the client went away mid-stream
+                    outcome = "cancelled"
+                    raise
+                finally:
+                    LLM_CALL_SECONDS.observe(time.perf_counter() - call_started,
+                                             task=task, call="stream", outcome=outcome)
+            return
+        except Exception as e:
+            attempt += 1
+            if started or attempt > retries or not backend.retryable(e):
+                raise
+            delay = LLM_BACKOFF * (2 ** (attempt - 1)) * (1 + random.random())
+            print(f"{task} stream failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
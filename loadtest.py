@@ -0,0 +1,399 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+
+# End-to-end load test of the Flask API. By default base.py is started with the
+# fake LLM backend (LLM_BACKEND=fake) and its latency, token rate and error rate
+# set from the command line, then a weighted mix of requests is sent by an
+# increasing number of concurrent clients. Every stage reports throughput,
+# p50/p95/p99 latency, error and rejection rates and the server's memory.
+#
+#   python loadtest.py --concurrency 1,8,32,64 --duration 30 --output new.json
+#   python loadtest.py --output new.json --compare old.json
+#   python loadtest.py --url http://localhost:5001   (an already running API)
+DEFAULT_MIX = "roadmap=1,quiz=4,resource=2,quiz-stream=1,resource-stream=1"
+
+TOPICS = [
+    "Machine Learning", "Linear Algebra", "Web Development", "Databases", "Operating Systems",
+    "Computer Networks", "Statistics", "Data Structures", "Algorithms", "Cryptography",
+    "Compilers", "Computer Graphics", "Cloud Computing", "Deep Learning", "Calculus",
+    "Organic Chemistry", "Microeconomics", "World History", "Music Theory", "Photography",
+]
+LEVELS = ["Absoulte Beginner", "Beginner", "Intermediate", "Advanced"]
+
+
+def roadmap_body(rng, topic):
+    return "/api/roadmap", {
+        "topic": topic,
+        "time": f"{rng.choice([2, 4, 6, 8])} weeks",
+        "knowledge_level": rng.choice(LEVELS),
+    }
+
+
+def quiz_body(rng, topic):
+    week = rng.randint(1, 4)
+    return "/api/quiz", {
+        "course": topic,
+        "topic": f"{topic} week {week}",
+        "subtopic": f"{topic} part {rng.randint(1, 3)}",
+        "description": f"Core ideas of {topic} covered in week {week}",
+    }
+
+
+def resource_body(rng, topic):
+    return "/api/generate-resource", {
+        "course": topic,
+        "knowledge_level": rng.choice(LEVELS),
+        "description": f"An introduction to {topic}",
+        "time": f"{rng.choice([1, 2, 4])} weeks",
+    }
+
+
+def stream_of(body):
+    def stream_body(rng, topic):
+        path, payload = body(rng, topic)
+        return path + "/stream", payload
+    return stream_body
+
+
+REQUESTS = {
+    "roadmap": roadmap_body,
+    "quiz": quiz_body,
+    "resource": resource_body,
+    "quiz-stream": stream_of(quiz_body),
+    "resource-stream": stream_of(resource_body),
+}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in REQUESTS:
+            raise ValueError(f"unknown request type {name!r}, expected one of {', '.join(REQUESTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def rss_mb(pid):
+    # resident memory of pid from /proc, None where that isn't available
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir):
+    port = free_port()
+    env = dict(
+        os.environ,
+        HOST="127.0.0.1",
+        PORT=str(port),
+        LLM_BACKEND="fake",
+        FAKE_LLM_LATENCY=str(args.llm_latency),
+        FAKE_LLM_TOKEN_RATE=str(args.llm_token_rate),
+        FAKE_LLM_ERROR_RATE=str(args.llm_error_rate),
+        RESPONSE_CACHE_PATH=os.path.join(workdir, "response_cache.sqlite3"),
+    )
+    log = open(args.server_log or os.devnull, "w")
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "base.py")],
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"API exited with {server.returncode}, see --server-log")
+        try:
+            get_json(url, "/api/server/stats")
+            return server, url
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("API did not start within 60s")
+
+
+def get_json(url, path):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return json.loads(response.read())
+    finally:
+        conn.close()
+
+
+class Client(threading.Thread):
+    # one closed-loop user: sends a request, waits for the full response, repeats
+    def __init__(self, url, mix, topics, fresh_ratio, timeout, deadline, seed):
+        super().__init__(daemon=True)
+        self.parts = urlsplit(url)
+        self.names = list(mix)
+        self.weights = list(mix.values())
+        self.topics = topics
+        self.fresh_ratio = fresh_ratio
+        self.timeout = timeout
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.conn = None
+        # (request type, status or None, latency, time to first byte, error)
+        self.samples = []
+
+    def connect(self):
+        if self.conn is None:
+            # keep-alive, like a browser or the Streamlit client
+            self.conn = http.client.HTTPConnection(
+                self.parts.hostname, self.parts.port, timeout=self.timeout
+            )
+        return self.conn
+
+    def send(self, name):
+        path, payload = REQUESTS[name](self.rng, self.rng.choice(self.topics))
+        if self.rng.random() < self.fresh_ratio:
+            payload["fresh"] = True
+        started = time.perf_counter()
+        try:
+            conn = self.connect()
+            conn.request("POST", path, body=json.dumps(payload),
+                         headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            first = response.read(1)
+            first_byte = time.perf_counter() - started
+            body = first + response.read()
+            latency = time.perf_counter() - started
+            error = None
+            if response.status >= 400:
+                error = f"HTTP {response.status}"
+            elif b"event: error" in body:
+                # streams report generation failures in-band after a 200
+                error = "stream error"
+            if response.will_close:
+                self.close()
+            return name, response.status, latency, first_byte, error
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            latency = time.perf_counter() - started
+            return name, None, latency, latency, type(e).__name__
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            name = self.rng.choices(self.names, self.weights)[0]
+            self.samples.append(self.send(name))
+        self.close()
+
+
+def summarize(samples, duration):
+    latencies = [s[2] * 1000 for s in samples if s[4] is None]
+    errors = [s for s in samples if s[4] is not None]
+    rejected = [s for s in samples if s[1] == 503]
+    return {
+        "requests": len(samples),
+        "throughput": (len(samples) - len(errors)) / duration,
+        "errors": len(errors),
+        "error_rate": len(errors) / len(samples) if samples else 0.0,
+        "rejected": len(rejected),
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies, default=0.0),
+        },
+        "first_byte_ms_p50": percentile([s[3] * 1000 for s in samples if s[4] is None], 50),
+    }
+
+
+def run_stage(url, args, mix, topics, concurrency, server_pid):
+    deadline = time.monotonic() + args.duration
+    clients = [
+        Client(url, mix, topics, args.fresh_ratio, args.timeout, deadline,
+               seed=f"{args.seed}-{concurrency}-{i}")
+        for i in range(concurrency)
+    ]
+    rss_start = rss_mb(server_pid) if server_pid else None
+    rss_peak = rss_start
+    started = time.monotonic()
+    for client in clients:
+        client.start()
+    while any(client.is_alive() for client in clients):
+        time.sleep(0.25)
+        rss = rss_mb(server_pid) if server_pid else None
+        if rss is not None:
+            rss_peak = max(rss_peak or 0.0, rss)
+    duration = time.monotonic() - started
+
+    samples = [sample for client in clients for sample in client.samples]
+    stage = {"concurrency": concurrency, "duration": duration, **summarize(samples, duration)}
+    stage["endpoints"] = {
+        name: summarize([s for s in samples if s[0] == name], duration) for name in mix
+    }
+    stage["error_kinds"] = {}
+    for sample in samples:
+        if sample[4] is not None:
+            stage["error_kinds"][sample[4]] = stage["error_kinds"].get(sample[4], 0) + 1
+    rss_end = rss_mb(server_pid) if server_pid else None
+    stage["server_rss_mb"] = {"start": rss_start, "peak": rss_peak, "end": rss_end}
+    return stage
+
+
+def compare(stages, baseline, threshold):
+    # prints throughput, p95 and error rate against a previous run, returns the regressions
+    previous = {stage["concurrency"]: stage for stage in baseline["stages"]}
+    regressions = []
+    print(f"\n{'stage':<28} {'req/s':>18} {'p95 ms':>20} {'errors':>16}")
+    for stage in stages:
+        old_stage = previous.get(stage["concurrency"])
+        if old_stage is None:
+            continue
+        rows = [("all", stage, old_stage)] + [
+            (name, stage["endpoints"][name], old_stage["endpoints"][name])
+            for name in stage["endpoints"] if name in old_stage["endpoints"]
+        ]
+        for name, new, old in rows:
+            label = f"c={stage['concurrency']} {name}"
+            throughput_change = ((new["throughput"] - old["throughput"]) / old["throughput"]
+                                 if old["throughput"] else 0.0)
+            old_p95, new_p95 = old["latency_ms"]["p95"], new["latency_ms"]["p95"]
+            p95_change = (new_p95 - old_p95) / old_p95 if old_p95 else 0.0
+            regressed = (throughput_change < -threshold or p95_change > threshold
+                         or new["error_rate"] > old["error_rate"] + 0.01)
+            if regressed:
+                regressions.append(label)
+            print(f"{label:<28} {old['throughput']:7.1f} -> {new['throughput']:7.1f} "
+                  f"{old_p95:8.0f} -> {new_p95:8.0f} "
+                  f"{old['error_rate']:6.1%} -> {new['error_rate']:6.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the API against the fake LLM backend.")
+    parser.add_argument("--url", help="test an already running API instead of starting base.py")
+    parser.add_argument("--concurrency", default="1,4,16,32", help="concurrent clients per stage")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per stage")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="request type weights")
+    parser.add_argument("--topics", type=int, default=len(TOPICS),
+                        help="distinct topics; fewer means more cache hits and coalescing")
+    parser.add_argument("--fresh-ratio", type=float, default=0.0,
+                        help="share of requests sent with fresh=true, bypassing the cache")
+    parser.add_argument("--timeout", type=float, default=120, help="client timeout in seconds")
+    parser.add_argument("--seed", default="loadtest")
+    parser.add_argument("--llm-latency", type=float, default=0.5,
+                        help="fake LLM time to first token in seconds")
+    parser.add_argument("--llm-token-rate", type=float, default=100,
+                        help="fake LLM output tokens per second (0: instant)")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0,
+                        help="share of fake LLM calls that fail")
+    parser.add_argument("--server-log", help="file for the API's output (default: discarded)")
+    parser.add_argument("--output", default="bench_loadtest.json")
+    parser.add_argument("--compare", help="previous --output file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative throughput drop or p95 increase reported as a regression")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    concurrency_levels = [int(c) for c in args.concurrency.split(",")]
+    topics = [TOPICS[i % len(TOPICS)] + ("" if i < len(TOPICS) else f" {i // len(TOPICS)}")
+              for i in range(args.topics)]
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    server = None
+    if args.url:
+        url = args.url.rstrip("/")
+    else:
+        server, url = start_server(args, workdir)
+    try:
+        stages = []
+        for concurrency in concurrency_levels:
+            stage = run_stage(url, args, mix, topics, concurrency, server.pid if server else None)
+            stages.append(stage)
+            rss = stage["server_rss_mb"]
+            memory = (f"  rss {rss['start']:.0f} -> {rss['end']:.0f} MB (peak {rss['peak']:.0f})"
+                      if rss["start"] is not None else "")
+            print(f"c={concurrency:<4} {stage['requests']:6d} req  {stage['throughput']:7.1f} req/s  "
+                  f"p50 {stage['latency_ms']['p50']:7.0f} ms  p95 {stage['latency_ms']['p95']:7.0f} ms  "
+                  f"p99 {stage['latency_ms']['p99']:7.0f} ms  errors {stage['error_rate']:6.1%}  "
+                  f"503 {stage['rejected']}{memory}", flush=True)
+        try:
+            cache_stats = get_json(url, "/api/cache/stats")
+        except (OSError, ValueError):
+            cache_stats = None
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=60)
+
+    report = {
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+        "stages": stages,
+        "cache_stats": cache_stats,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(stages, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+# metrics py
+"""
+Latency histograms for the video and LLM hot paths, in Prometheus format.
+
+Histograms are declared once at import time and observed with
+``HISTOGRAM.labels(...).observe(seconds)`` or ``with HISTOGRAM.time(...)``.
+The vision code runs in the Streamlit server and in frame pool workers, not
+in the API, so every process that records anything writes a snapshot of its
+histograms to METRICS_DIR every few seconds; the API's /metrics endpoint adds
+up the snapshots of all processes (including other API workers) and its own.
+
+Configuration (environment variables):
+
+- METRICS_ENABLED: set to 0 to turn every timer into a no-op (default 1)
+- METRICS_DIR: directory for the per-process snapshots, empty to only report
+  the API process itself (default <tmp>/learning-platform-metrics)
+- METRICS_FLUSH_INTERVAL: seconds between snapshots (default 5)
+- METRICS_STALE_AFTER: snapshots not rewritten for this many seconds are
+  deleted, e.g. from exited processes (default 3600)
+"""
+
+import os
+import json
+import time
+import atexit
+import bisect
+import socket
+import tempfile
+import threading
+import contextlib
+
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+METRICS_DIR = os.environ.get(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "learning-platform-metrics")
+)
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_STALE_AFTER = float(os.environ.get("METRICS_STALE_AFTER", "3600"))
+
+VIDEO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192, 16384, 32768)
+
+_registry = {}
+_registry_lock = threading.Lock()
+_writer = None
+
+
+class _Child:
+    # one label combination: per-bucket counts, the last one is +Inf
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+        _ensure_writer()
+
+    @contextlib.contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class _NullChild:
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return contextlib.nullcontext()
+
+
+_NULL_CHILD = _NullChild()
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=VIDEO_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(float(b) for b in buckets)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **labels):
+        if not METRICS_ENABLED:
+            return _NULL_CHILD
+        key = tuple(str(v) for v in values) or tuple(str(labels[n]) for n in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, _Child(self.buckets))
+        return child
+
+    def observe(self, value, *values, **labels):
+        self.labels(*values, **labels).observe(value)
+
+    def time(self, *values, **labels):
+        return self.labels(*values, **labels).time()
+
+    def snapshot(self):
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for key, child in children:
+            with child._lock:
+                samples.append([list(key), list(child.counts), child.sum])
+        return {
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+            "buckets": list(self.buckets),
+            "samples": samples,
+        }
+
+
+def histogram(name, documentation, labelnames=(), buckets=VIDEO_BUCKETS):
+    # declares (or returns the already declared) histogram called name
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = Histogram(name, documentation, labelnames, buckets)
+        return metric
+
+
+def snapshot():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {metric.name: metric.snapshot() for metric in metrics}
+
+
+def _snapshot_path(pid=None):
+    return os.path.join(METRICS_DIR, f"{socket.gethostname()}-{pid or os.getpid()}.json")
+
+
+def write_snapshot():
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _snapshot_path()
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp, path)
+
+
+def _write_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            write_snapshot()
+        except OSError as e:
+            print(f"Error writing metrics snapshot: {e}")
+
+
+def _ensure_writer():
+    # started by the first observation, so processes that record nothing write nothing
+    global _writer
+    if _writer is not None or not METRICS_DIR:
+        return
+    with _registry_lock:
+        if _writer is not None:
+            return
+        _writer = threading.Thread(target=_write_loop, name="metrics-writer", daemon=True)
+        _writer.start()
+    atexit.register(write_snapshot)
+
+
+def _read_snapshots():
+    # snapshots of the other processes, deleting the ones that went stale
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return []
+    own = _snapshot_path()
+    snapshots = []
+    now = time.time()
+    for name in os.listdir(METRICS_DIR):
+        path = os.path.join(METRICS_DIR, name)
+        if not name.endswith(".json") or path == own:
+            continue
+        try:
+            if now - os.path.getmtime(path) > METRICS_STALE_AFTER:
+                os.remove(path)
+                continue
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _merge(snapshots):
+    merged = {}
+    for snap in snapshots:
+        for name, metric in snap.items():
+            target = merged.setdefault(name, {
+                "help": metric["help"],
+                "labelnames": metric["labelnames"],
+                "buckets": metric["buckets"],
+                "samples": {},
+            })
+            if metric["buckets"] != target["buckets"]:
+                # declared differently by another version of the code
+                continue
+            for key, counts, total in metric["samples"]:
+                key = tuple(key)
+                if key in target["samples"]:
+                    old_counts, old_total = target["samples"][key]
+                    counts = [a + b for a, b in zip(old_counts, counts)]
+                    total += old_total
+                target["samples"][key] = (counts, total)
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(pairs):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}" if pairs else ""
+
+
+def _format_bound(bound):
+    return repr(float(bound)) if bound != int(bound) else f"{bound:.1f}"
+
+
+def render():
+    # Prometheus text exposition format for this process and every snapshot in METRICS_DIR
+    merged = _merge([snapshot()] + _read_snapshots())
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} histogram")
+        for key in sorted(metric["samples"]):
+            counts, total = metric["samples"][key]
+            pairs = list(zip(metric["labelnames"], key))
+            cumulative = 0
+            for bound, count in zip(metric["buckets"] + ["+Inf"], counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_bound(bound)
+                lines.append(f"{name}_bucket{_format_labels(pairs + [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(pairs)} {total}")
+            lines.append(f"{name}_count{_format_labels(pairs)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+VIDEO_FRAME_SECONDS = histogram(
+    "video_frame_seconds", "Time spent in a video processor's recv() per frame", ["processor"]
+)
+VIDEO_STAGE_SECONDS = histogram(
+    "video_stage_seconds",
+    "Time per video processing stage: decode and encode (frame conversion), detect "
+    "(face detector), landmarks (shape predictor), pupil (pupil search), pool (frame pool "
+    "round trip), emotion (emotion label per face or frame), emotion_batch (batched model "
+    "forward pass)",
+    ["stage"],
+)
+LLM_CALL_SECONDS = histogram(
+    "llm_call_seconds", "Duration of one upstream generation attempt",
+    ["task", "call", "outcome"], LLM_BUCKETS,
+)
+LLM_FIRST_CHUNK_SECONDS = histogram(
+    "llm_first_chunk_seconds", "Time to the first chunk of a streamed generation", ["task"], LLM_BUCKETS
+)
+LLM_PROMPT_TOKENS = histogram(
+    "llm_prompt_tokens", "Prompt tokens per generation", ["task"], TOKEN_BUCKETS
+)
+LLM_OUTPUT_TOKENS = histogram(
+    "llm_output_tokens", "Output tokens per generation", ["task"], TOKEN_BUCKETS
+)
@@ -0,0 +1,154 @@
+# prefetch py
+"""
+Background quiz prefetching for generated roadmaps.
+
+Once a roadmap is produced, a quiz for each of its subtopics is generated by a
+small worker pool and stored in the response cache under the same key
+/api/quiz uses, so opening any of those quizzes is a cache hit. Prefetching
+runs at low priority: workers hold off while foreground requests keep the
+upstream slots busy, earlier weeks go first, and spend is capped per roadmap
+and per hour. Jobs for a roadmap can be cancelled once the user abandons it.
+"""
+
+import os
+import time
+import queue
+import itertools
+import threading
+import collections
+
+import cache
+import llm
+import quiz
+
+
+# callers opt in per roadmap request, this switch turns the feature off server-wide
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "2"))
+PREFETCH_MAX_PER_ROADMAP = int(os.environ.get("PREFETCH_MAX_PER_ROADMAP", "20"))
+PREFETCH_HOURLY_BUDGET = int(os.environ.get("PREFETCH_HOURLY_BUDGET", "200"))
+# prefetch only starts a call while fewer upstream calls than this are running
+PREFETCH_MAX_BUSY = int(os.environ.get("PREFETCH_MAX_BUSY", str(max(1, llm.LLM_MAX_CONCURRENCY // 2))))
+
+
+def roadmap_quizzes(course, roadmap_data):
+    # the quiz fields for every subtopic of a roadmap, in roadmap order
+    for week_data in roadmap_data.values():
+        if not isinstance(week_data, dict):
+            continue
+        for subtopic in week_data.get("subtopics", []):
+            fields = {
+                "course": course,
+                "topic": week_data.get("topic"),
+                "subtopic": subtopic.get("subtopic"),
+                "description": subtopic.get("description"),
+            }
+            if all(fields.values()):
+                yield fields
+
+
+class QuizPrefetcher:
+    def __init__(self, flight, workers=PREFETCH_WORKERS,
+                 max_per_roadmap=PREFETCH_MAX_PER_ROADMAP,
+                 hourly_budget=PREFETCH_HOURLY_BUDGET, max_busy=PREFETCH_MAX_BUSY,
+                 semantic=None):
+        self.flight = flight
+        # semantic_cache.SemanticIndex the prefetched quizzes are added to
+        self.semantic = semantic
+        self.max_per_roadmap = max_per_roadmap
+        self.hourly_budget = hourly_budget
+        self.max_busy = max_busy
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._cancelled = set()
+        self._pending = collections.Counter()
+        self._spent = collections.deque()
+        self.counts = collections.Counter()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"quiz-prefetch-{i}", daemon=True).start()
+
+    def submit(self, prefetch_id, course, roadmap_data):
+        queued = 0
+        with self._lock:
+            self._cancelled.discard(prefetch_id)
+            for priority, fields in enumerate(roadmap_quizzes(course, roadmap_data)):
+                if priority >= self.max_per_roadmap:
+                    self.counts["skipped_roadmap_cap"] += 1
+                    continue
+                self._queue.put((priority, next(self._seq), prefetch_id, fields))
+                self._pending[prefetch_id] += 1
+                queued += 1
+            self.counts["queued"] += queued
+        return queued
+
+    def cancel(self, prefetch_id):
+        with self._lock:
+            if self._pending[prefetch_id]:
+                self._cancelled.add(prefetch_id)
+            return self._pending[prefetch_id]
+
+    def status(self, prefetch_id):
+        with self._lock:
+            return {
+                "pending": self._pending[prefetch_id],
+                "cancelled": prefetch_id in self._cancelled,
+            }
+
+    def _take_budget(self):
+        now = time.time()
+        with self._lock:
+            while self._spent and now - self._spent[0] > 3600:
+                self._spent.popleft()
+            if len(self._spent) >= self.hourly_budget:
+                return False
+            self._spent.append(now)
+            return True
+
+    def _done(self, prefetch_id, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+            self._pending[prefetch_id] -= 1
+            if self._pending[prefetch_id] <= 0:
+                del self._pending[prefetch_id]
+                self._cancelled.discard(prefetch_id)
+
+    def _work(self):
+        while True:
+            _, _, prefetch_id, fields = self._queue.get()
+            try:
+                # yield to foreground traffic
+                while llm.in_flight() >= self.max_busy and prefetch_id not in self._cancelled:
+                    time.sleep(0.5)
+                if prefetch_id in self._cancelled:
+                    self._done(prefetch_id, "cancelled")
+                    continue
+                key = cache.make_key("quiz", fields)
+                if self.flight.cache.peek(key) is not None:
+                    self._done(prefetch_id, "already_cached")
+                    continue
+                if not self._take_budget():
+                    self._done(prefetch_id, "skipped_budget")
+                    continue
+                started = time.perf_counter()
+                value = self.flight.get_or_create(
+                    "quiz", fields, lambda: quiz.get_quiz(**fields), fresh=True
+                )
+                if self.semantic is not None:
+                    self.semantic.add("quiz", fields, value, time.perf_counter() - started)
+                self._done(prefetch_id, "generated")
+            except Exception as e:
+                print(f"quiz prefetch failed for {fields['subtopic']}: {e}")
+                self._done(prefetch_id, "failed")
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue": self._queue.qsize(),
+                "active_roadmaps": len(self._pending),
+                "spent_last_hour": len(self._spent),
+                "hourly_budget": self.hourly_budget,
+                **self.counts,
+            }
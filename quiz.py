@@ -1,64 +1,170 @@
 #quiz py
-"""
-Install the Google AI Python SDK
+import os
+import re
+import json
+import llm
+import jsonstream
+from concurrent.futures import ThreadPoolExecutor
 
-$ pip install google-generativeai
 
-See the getting started guide for more information:
-https://ai.google.dev/gemini-api/docs/get-started/python
-"""
+GENERATION_CONFIG = llm.generation_config(max_output_tokens=20000)
 
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
-import json
+SYSTEM_INSTRUCTION = """You are an AI agent who provides quizzes to test understanding of user on a topic. The quiz will be based on topic, subtopic and the description of subtopic which describes what exactly to learn. Output questions in JSON format. The questions must be Multiple Choice Questions, can include calculation if necessary. Decide the number of questions based on description of the subtopic. Try to make as many questions as possible. Include questions that require deep thinking. output in format {questions:[ {question: "...", options:[...], answerIndex:"...", reason:"..."}]"""
 
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
 
-load_dotenv()
+def quiz_prompt(course, topic, subtopic, description):
+    return f'The user is learning the course {course}. In the course the user is learning topic "{topic}". Create quiz on subtopic "{subtopic}". The description of the subtopic is "{description}".'
 
 
 def get_quiz(course, topic, subtopic, description):
-    # Create the model
-    # See https://ai.google.dev/api/python/google/generativeai/GenerativeModel
-    generation_config = {
-        "temperature": 1,
-        "top_p": 0.95,
-        "top_k": 64,
-        "max_output_tokens": 20000,
-        "response_mime_type": "application/json",
-    }
-    safety_settings = [
-        {
-            "category": "HARM_CATEGORY_HARASSMENT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-        {
-            "category": "HARM_CATEGORY_HATE_SPEECH",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-        {
-            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-        {
-            "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-    ]
-
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        safety_settings=safety_settings,
-        generation_config=generation_config,
-        system_instruction="""You are an AI agent who provides quizzes to test understanding of user on a topic. The quiz will be based on topic, subtopic and the description of subtopic which describes what exactly to learn. Output questions in JSON format. The questions must be Multiple Choice Questions, can include calculation if necessary. Decide the number of questions based on description of the subtopic. Try to make as many questions as possible. Include questions that require deep thinking. output in format {questions:[ {question: "...", options:[...], answerIndex:"...", reason:"..."}]""",
+    response_text = llm.generate(
+        "quiz",
+        quiz_prompt(course, topic, subtopic, description),
+        system_instruction=SYSTEM_INSTRUCTION,
+        generation_config=GENERATION_CONFIG,
+        safety_settings=llm.SAFETY_SETTINGS,
     )
+    print(response_text)
+    return json.loads(response_text)
+
+
+def stream_quiz(course, topic, subtopic, description):
+    # yields each question as soon as its JSON object is complete
+    parser = jsonstream.ArrayItemParser("questions")
+    for chunk in llm.stream(
+        "quiz",
+        quiz_prompt(course, topic, subtopic, description),
+        system_instruction=SYSTEM_INSTRUCTION,
+        generation_config=GENERATION_CONFIG,
+        safety_settings=llm.SAFETY_SETTINGS,
+    ):
+        for question in parser.feed(chunk):
+            if validate_quiz({"questions": [question]}):
+                yield question
+
+
+# Batched generation: several subtopics per upstream call, packed by the
+# output-token budget of GENERATION_CONFIG
+QUIZ_BATCH_TOKENS_PER_ITEM = int(os.environ.get("QUIZ_BATCH_TOKENS_PER_ITEM", "2500"))
+QUIZ_BATCH_RETRIES = int(os.environ.get("QUIZ_BATCH_RETRIES", "2"))
+QUIZ_BATCH_CONCURRENCY = int(os.environ.get("QUIZ_BATCH_CONCURRENCY", "4"))
+
+BATCH_SYSTEM_INSTRUCTION = """You are an AI agent who provides quizzes to test understanding of user on a topic. You will get a numbered list of subtopics, each with the topic it belongs to and a description of what exactly to learn. Create a separate quiz for every subtopic. The questions must be Multiple Choice Questions, can include calculation if necessary. Decide the number of questions based on description of the subtopic, at most 10 per subtopic. Include questions that require deep thinking. output in format {quizzes:[ {id: <number of the subtopic>, questions:[ {question: "...", options:[...], answerIndex:"...", reason:"..."}]}]}"""
+
+
+def validate_quiz(quiz):
+    # a quiz is usable by app.py only if every question can be rendered and scored
+    questions = quiz.get("questions") if isinstance(quiz, dict) else None
+    if not isinstance(questions, list) or not questions:
+        return False
+    for question in questions:
+        if not isinstance(question, dict) or not isinstance(question.get("question"), str):
+            return False
+        options = question.get("options")
+        if not isinstance(options, list) or len(options) < 2:
+            return False
+        try:
+            answer = int(question.get("answerIndex"))
+        except (TypeError, ValueError):
+            return False
+        if not 0 <= answer < len(options):
+            return False
+    return True
+
+
+def batch_prompt(course, items):
+    lines = [f"The user is learning the course {course}. Create quizzes on these subtopics:"]
+    for i, item in items:
+        lines.append(
+            f'{i}. Topic "{item["topic"]}", subtopic "{item["subtopic"]}", description "{item["description"]}"'
+        )
+    return "\n".join(lines)
 
-    chat_session = model.start_chat(history=[])
 
-    response = chat_session.send_message(
-        f'The user is learning the course {course}. In the course the user is learning topic "{topic}". Create quiz on subtopic "{subtopic}". The description of the subtopic is "{description}".',
-        stream=False,
+def _generate_batch(course, items):
+    # items is a list of (id, item); returns {id: quiz} for the quizzes that validated
+    response_text = llm.generate(
+        "quiz-batch",
+        batch_prompt(course, items),
+        system_instruction=BATCH_SYSTEM_INSTRUCTION,
+        generation_config=GENERATION_CONFIG,
+        safety_settings=llm.SAFETY_SETTINGS,
     )
-    print(response.text)
-    return json.loads(response.text)
+    try:
+        quizzes = json.loads(response_text).get("quizzes", [])
+    except (ValueError, AttributeError):
+        return {}
+    wanted = {i for i, _ in items}
+    results = {}
+    for quiz in quizzes:
+        if not isinstance(quiz, dict):
+            continue
+        try:
+            i = int(quiz.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if i in wanted and validate_quiz(quiz):
+            results[i] = {"questions": quiz["questions"]}
+    return results
+
+
+def get_quiz_batch(items):
+    # items are {"course", "topic", "subtopic", "description"} dicts. Returns a
+    # list aligned with items holding {"questions": [...]}, or {"error": "..."}
+    # for items that still failed after QUIZ_BATCH_RETRIES rounds; only the
+    # failed items are sent again.
+    per_call = max(1, GENERATION_CONFIG["max_output_tokens"] // QUIZ_BATCH_TOKENS_PER_ITEM)
+    results = {}
+    remaining = list(enumerate(items))
+    for _ in range(1 + QUIZ_BATCH_RETRIES):
+        if not remaining:
+            break
+        # one call only ever covers a single course
+        groups = []
+        by_course = {}
+        for i, item in remaining:
+            by_course.setdefault(item["course"], []).append((i, item))
+        for course, course_items in by_course.items():
+            for start in range(0, len(course_items), per_call):
+                groups.append((course, course_items[start:start + per_call]))
+
+        with ThreadPoolExecutor(max_workers=min(len(groups), QUIZ_BATCH_CONCURRENCY)) as pool:
+            futures = [pool.submit(_generate_batch, course, group) for course, group in groups]
+            for future in futures:
+                try:
+                    results.update(future.result())
+                except Exception as e:
+                    print(f"quiz batch failed: {e}")
+        remaining = [(i, item) for i, item in remaining if i not in results]
+
+    return [results.get(i, {"error": "Quiz generation failed"}) for i in range(len(items))]
+
+
+def fake_quiz(prompt, generation_config):
+    rng = llm.fake_rng(prompt)
+    questions = []
+    for i in range(1, rng.randint(4, 8) + 1):
+        answer = rng.randint(0, 3)
+        questions.append(
+            {
+                "question": f"Question {i}?",
+                "options": [f"Option {j + 1}" for j in range(4)],
+                "answerIndex": str(answer),
+                "reason": f"Option {answer + 1} is correct.",
+            }
+        )
+    return json.dumps({"questions": questions})
+
+
+llm.register_fake("quiz", fake_quiz)
+
+
+def fake_quiz_batch(prompt, generation_config):
+    quizzes = []
+    for match in re.finditer(r"^(\d+)\. (.*)$", prompt, re.MULTILINE):
+        quiz = json.loads(fake_quiz(match.group(2), generation_config))
+        quizzes.append({"id": int(match.group(1)), "questions": quiz["questions"]})
+    return json.dumps({"quizzes": quizzes})
+
+
+llm.register_fake("quiz-batch", fake_quiz_batch)
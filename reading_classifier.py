@@ -0,0 +1,222 @@
+import os
+import csv
+import sys
+import math
+import argparse
+
+import numpy as np
+
+# Streaming reading detection from a pupil trace. Each sample is the gaze
+# offset (pupil relative to the eye center, averaged over both eyes and divided
+# by the distance between the eyes, so head movement and distance to the
+# camera cancel out). Velocities between consecutive samples are classified as
+# fixation, forward (rightward) saccade, return sweep or vertical movement (a
+# saccade spanning several samples counts once), and running counts over a
+# fixed-size window of recent samples are updated as samples enter and leave
+# it, so every update is O(1). Reading is a window with
+# enough forward saccades, few leftward ones, mostly fixations, and little
+# vertical movement.
+READING_WINDOW = int(os.environ.get("READING_WINDOW", "45"))
+# time constant in seconds of the exponential smoothing against pupil jitter,
+# independent of the frame rate
+READING_SMOOTHING = float(os.environ.get("READING_SMOOTHING", "0.05"))
+READING_SACCADE_VELOCITY = float(os.environ.get("READING_SACCADE_VELOCITY", "0.2"))
+READING_FIXATION_VELOCITY = float(os.environ.get("READING_FIXATION_VELOCITY", "0.15"))
+READING_MIN_SACCADE_RATE = float(os.environ.get("READING_MIN_SACCADE_RATE", "0.5"))
+READING_MIN_FIXATION = float(os.environ.get("READING_MIN_FIXATION", "0.4"))
+READING_MAX_VERTICAL_RATIO = float(os.environ.get("READING_MAX_VERTICAL_RATIO", "0.5"))
+# leftward saccades (return sweeps, regressions) per forward saccade; jitter
+# moves the gaze both ways about equally often, reading mostly rightward
+READING_MAX_RETURN_RATIO = float(os.environ.get("READING_MAX_RETURN_RATIO", "0.5"))
+# a longer gap between samples (face lost, frames dropped) starts a new window;
+# EyeProcessor raises it to cover the frame governor's lowest analysis rate
+READING_MAX_GAP = float(os.environ.get("READING_MAX_GAP", "0.5"))
+
+# per-sample movement classes, columns of the window's feature array
+FIXATION, FORWARD, RETURN, VERTICAL = range(4)
+
+
+def gaze_point(left_eye, right_eye):
+    # normalized gaze offset from two (eye center, pupil) pairs, None if either
+    # eye is missing or both eyes share a center
+    if not left_eye or not right_eye:
+        return None
+    (lcx, lcy), (lpx, lpy) = left_eye
+    (rcx, rcy), (rpx, rpy) = right_eye
+    eye_distance = math.hypot(rcx - lcx, rcy - lcy)
+    if eye_distance == 0:
+        return None
+    x = ((lpx - lcx) + (rpx - rcx)) / 2 / eye_distance
+    y = ((lpy - lcy) + (rpy - rcy)) / 2 / eye_distance
+    return x, y
+
+
+class ReadingClassifier:
+    def __init__(self, window=READING_WINDOW, smoothing=READING_SMOOTHING,
+                 saccade_velocity=READING_SACCADE_VELOCITY,
+                 fixation_velocity=READING_FIXATION_VELOCITY,
+                 min_saccade_rate=READING_MIN_SACCADE_RATE,
+                 min_fixation=READING_MIN_FIXATION,
+                 max_vertical_ratio=READING_MAX_VERTICAL_RATIO,
+                 max_return_ratio=READING_MAX_RETURN_RATIO,
+                 max_gap=READING_MAX_GAP):
+        self.window = window
+        self.smoothing = smoothing
+        self.saccade_velocity = saccade_velocity
+        self.fixation_velocity = fixation_velocity
+        self.min_saccade_rate = min_saccade_rate
+        self.min_fixation = min_fixation
+        self.max_vertical_ratio = max_vertical_ratio
+        self.max_return_ratio = max_return_ratio
+        self.max_gap = max_gap
+
+        # ring buffers of the last `window` samples
+        self.times = np.zeros(window, dtype=np.float64)
+        self.positions = np.zeros((window, 2), dtype=np.float64)
+        self.durations = np.zeros(window, dtype=np.float64)
+        self.features = np.zeros((window, 4), dtype=np.int8)
+        self.reset()
+
+    def reset(self):
+        self._count = 0  # samples in the window
+        self._next = 0  # slot the next sample goes to
+        self._last = None  # (t, smoothed x, smoothed y) of the previous sample
+        self._sums = np.zeros(4, dtype=np.int64)
+        self._duration = 0.0
+        self._movement = None  # class of the previous sample
+        self.reading = False
+
+    def _push(self, t, x, y, dt, feature):
+        i = self._next
+        if self._count == self.window:
+            # the oldest sample leaves the window
+            self._sums -= self.features[i]
+            self._duration -= self.durations[i]
+        else:
+            self._count += 1
+        self.times[i] = t
+        self.positions[i] = (x, y)
+        self.durations[i] = dt
+        self.features[i] = feature
+        self._sums += feature
+        self._duration += dt
+        self._next = (i + 1) % self.window
+
+    def movement(self, vx, vy):
+        # class of a sample from its velocity, None between the thresholds
+        if math.hypot(vx, vy) < self.fixation_velocity:
+            return FIXATION
+        if abs(vy) > abs(vx):
+            return VERTICAL if abs(vy) > self.saccade_velocity else None
+        if vx > self.saccade_velocity:
+            return FORWARD
+        if vx < -self.saccade_velocity:
+            return RETURN
+        return None
+
+    def classify(self, vx, vy):
+        # feature row of a sample: fixation samples are counted, saccades only
+        # on the sample they start
+        feature = np.zeros(4, dtype=np.int8)
+        movement = self.movement(vx, vy)
+        if movement == FIXATION or (movement is not None and movement != self._movement):
+            feature[movement] = 1
+        self._movement = movement
+        return feature
+
+    def update(self, t, point):
+        # adds the gaze point (see gaze_point) seen at time t in seconds and
+        # returns whether the window looks like reading; None keeps the state
+        if point is None:
+            return self.reading
+        x, y = point
+        if self._last is not None:
+            last_t, last_x, last_y = self._last
+            dt = t - last_t
+            if dt <= 0:
+                return self.reading
+            if dt > self.max_gap:
+                self.reset()
+            else:
+                keep = math.exp(-dt / self.smoothing) if self.smoothing > 0 else 0.0
+                x = keep * last_x + (1 - keep) * x
+                y = keep * last_y + (1 - keep) * y
+                self._push(t, x, y, dt, self.classify((x - last_x) / dt, (y - last_y) / dt))
+        self._last = (t, x, y)
+        self.reading = self.evaluate()
+        return self.reading
+
+    def evaluate(self):
+        # needs at least half a window of samples before deciding
+        if self._count < max(2, self.window // 2) or self._duration <= 0:
+            return False
+        fixation, forward, returns, vertical = (int(n) for n in self._sums)
+        return (
+            forward / self._duration >= self.min_saccade_rate
+            and fixation / self._count >= self.min_fixation
+            and returns <= forward * self.max_return_ratio
+            and vertical <= (forward + returns) * self.max_vertical_ratio
+        )
+
+    def stats(self):
+        fixation, forward, returns, vertical = (int(n) for n in self._sums)
+        return {
+            "samples": self._count,
+            "duration": float(self._duration),
+            "fixations": fixation,
+            "forward_saccades": forward,
+            "return_sweeps": returns,
+            "vertical": vertical,
+            "reading": self.reading,
+        }
+
+
+def classify_trace(times, xs, ys, **options):
+    # offline: reading flag for every sample of a recorded gaze trace; NaN
+    # coordinates mark samples without a detected pupil
+    classifier = ReadingClassifier(**options)
+    result = np.zeros(len(times), dtype=bool)
+    for i, (t, x, y) in enumerate(zip(times, xs, ys)):
+        point = None if np.isnan(x) or np.isnan(y) else (x, y)
+        result[i] = classifier.update(float(t), point)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Classify a recorded gaze trace (CSV with columns t, x, y) as reading or not."
+    )
+    parser.add_argument("trace", help="CSV file, '-' for stdin")
+    parser.add_argument("--window", type=int, default=READING_WINDOW)
+    parser.add_argument("--saccade-velocity", type=float, default=READING_SACCADE_VELOCITY)
+    parser.add_argument("--fixation-velocity", type=float, default=READING_FIXATION_VELOCITY)
+    parser.add_argument("--min-saccade-rate", type=float, default=READING_MIN_SACCADE_RATE)
+    parser.add_argument("--min-fixation", type=float, default=READING_MIN_FIXATION)
+    parser.add_argument("--max-vertical-ratio", type=float, default=READING_MAX_VERTICAL_RATIO)
+    parser.add_argument("--max-return-ratio", type=float, default=READING_MAX_RETURN_RATIO)
+    parser.add_argument("--max-gap", type=float, default=READING_MAX_GAP)
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.trace == "-" else open(args.trace, newline="")
+    with source:
+        rows = list(csv.DictReader(source))
+    times = np.array([float(row["t"]) for row in rows])
+    xs = np.array([float(row["x"] or "nan") for row in rows])
+    ys = np.array([float(row["y"] or "nan") for row in rows])
+    reading = classify_trace(
+        times, xs, ys, window=args.window, saccade_velocity=args.saccade_velocity,
+        fixation_velocity=args.fixation_velocity, min_saccade_rate=args.min_saccade_rate,
+        min_fixation=args.min_fixation, max_vertical_ratio=args.max_vertical_ratio,
+        max_return_ratio=args.max_return_ratio, max_gap=args.max_gap,
+    )
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["t", "reading"])
+    for t, flag in zip(times, reading):
+        writer.writerow([f"{t:.3f}", int(flag)])
+    if len(reading):
+        print(f"reading {reading.mean():.1%} of {len(reading)} samples", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,131 @@
 # roadmap py
 import os
-import google.generativeai as genai
+import re
 import json
-from dotenv import load_dotenv
+import llm
+from concurrent.futures import ThreadPoolExecutor
 
 
-load_dotenv()
+GENERATION_CONFIG = llm.generation_config(max_output_tokens=8192)
 
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+SYSTEM_INSTRUCTION = 'You are an AI agent who provides good personalized learning paths based on user input. You have to provide subtopics to learn with a small description of the subtopic telling what exactly to learn and how much time each subtopic will take. Give more time to subtopics that require more understanding.\nExample output:\n{\n  "week 1": {\n    "topic":"Introduction to Python",\n    "subtopics":[\n      {\n        "subtopic":"Getting Started with Python",\n        "time":"10 minute",\n        "description":"Learn Hello world in python"\n      },\n      {\n        "subtopic":"Data types in Python",\n        "time":"1 hour",\n        "description":"Learn about int, string, boolean, array, dict and casting data types"\n      },\n     {\n        "subtopic":"Conditionals in Python",\n        "time":"30 minutes",\n        "description":"Learn about comparison operators, if elif else statements"\n      },\n      {\n        "subtopic":"Loops",\n        "time":"30 minutes",\n        "description":"Learn about for loop, while loop, continue and break"\n      },\n      {\n        "subtopic":"OOPs in Python",\n        "time":"4 hours",\n        "description":"Learn about classes, objects, inheritance, polymorphism and OOPs concepts"\n      },\n    ]\n  }\n}'
+
+
+def roadmap_prompt(topic, time, knowledge_level):
+    return f"Suggest a roadmap for learning {topic} in {time}. My Knowledge level is {knowledge_level}. I can spend total of 16 hours every week."
 
 
 def create_roadmap(topic, time, knowledge_level):
-    # Create the model
-    # See https://ai.google.dev/api/python/google/generativeai/GenerativeModel
-    generation_config = {
-        "temperature": 1,
-        "top_p": 0.95,
-        "top_k": 64,
-        "max_output_tokens": 8192,
-        "response_mime_type": "application/json",
+    response_text = llm.generate(
+        "roadmap",
+        roadmap_prompt(topic, time, knowledge_level),
+        system_instruction=SYSTEM_INSTRUCTION,
+        generation_config=GENERATION_CONFIG,
+        safety_settings=llm.SAFETY_SETTINGS,
+    )
+    print(response_text)
+    return json.loads(response_text)
+
+
+# Two-phase generation: a compact week-level outline first, then the subtopics
+# of every week generated concurrently. Latency is about one outline call plus
+# the slowest week instead of one long sequential generation, and no single
+# call has to fit a whole multi-week roadmap in its output budget.
+ROADMAP_MODE = os.environ.get("ROADMAP_MODE", "single")
+ROADMAP_WEEK_CONCURRENCY = int(os.environ.get("ROADMAP_WEEK_CONCURRENCY", "8"))
+
+OUTLINE_GENERATION_CONFIG = llm.generation_config(max_output_tokens=2048)
+
+OUTLINE_SYSTEM_INSTRUCTION = 'You are an AI agent who provides good personalized learning paths based on user input. Give only the outline of the learning path: for every week the main topic and one sentence on what the week should cover. Do not list subtopics.\nExample output:\n{\n  "week 1": {\n    "topic":"Introduction to Python",\n    "focus":"Syntax, data types, conditionals and loops"\n  },\n  "week 2": {\n    "topic":"Object Oriented Python",\n    "focus":"Classes, objects, inheritance and polymorphism"\n  }\n}'
+
+WEEK_SYSTEM_INSTRUCTION = 'You are an AI agent who provides good personalized learning paths based on user input. You get the outline of a learning path and have to detail one week of it. Provide subtopics to learn with a small description of the subtopic telling what exactly to learn and how much time each subtopic will take. Give more time to subtopics that require more understanding.\nExample output:\n{\n  "topic":"Introduction to Python",\n  "subtopics":[\n    {\n      "subtopic":"Getting Started with Python",\n      "time":"10 minute",\n      "description":"Learn Hello world in python"\n    },\n    {\n      "subtopic":"Loops",\n      "time":"30 minutes",\n      "description":"Learn about for loop, while loop, continue and break"\n    }\n  ]\n}'
+
+
+def create_roadmap_outline(topic, time, knowledge_level):
+    response_text = llm.generate(
+        "roadmap-outline",
+        roadmap_prompt(topic, time, knowledge_level),
+        system_instruction=OUTLINE_SYSTEM_INSTRUCTION,
+        generation_config=OUTLINE_GENERATION_CONFIG,
+        safety_settings=llm.SAFETY_SETTINGS,
+    )
+    return json.loads(response_text)
+
+
+def create_roadmap_week(topic, knowledge_level, outline, week):
+    response_text = llm.generate(
+        "roadmap-week",
+        f"I am learning {topic}. My Knowledge level is {knowledge_level}. I can spend total of 16 hours every week. The outline of my roadmap is {json.dumps(outline)}. Detail {week}.",
+        system_instruction=WEEK_SYSTEM_INSTRUCTION,
+        generation_config=GENERATION_CONFIG,
+        safety_settings=llm.SAFETY_SETTINGS,
+    )
+    week_data = json.loads(response_text)
+    if not isinstance(week_data, dict):
+        week_data = {}
+    # outline entries are model output too, a week may be a bare string
+    outline_week = outline.get(week)
+    if isinstance(outline_week, dict):
+        fallback_topic = outline_week.get("topic", "")
+    else:
+        fallback_topic = outline_week if isinstance(outline_week, str) else ""
+    subtopics = week_data.get("subtopics")
+    return {
+        "topic": week_data.get("topic") or fallback_topic,
+        "subtopics": subtopics if isinstance(subtopics, list) else [],
     }
-    safety_settings = [
-        {
-            "category": "HARM_CATEGORY_HARASSMENT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-        {
-            "category": "HARM_CATEGORY_HATE_SPEECH",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-        {
-            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
+
+
+def create_roadmap_parallel(topic, time, knowledge_level):
+    # same response shape as create_roadmap
+    outline = create_roadmap_outline(topic, time, knowledge_level)
+    weeks = list(outline.keys()) if isinstance(outline, dict) else []
+    if not weeks:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(weeks), ROADMAP_WEEK_CONCURRENCY)) as pool:
+        details = pool.map(
+            lambda week: create_roadmap_week(topic, knowledge_level, outline, week), weeks
+        )
+        roadmap = dict(zip(weeks, details))
+    print(json.dumps(roadmap))
+    return roadmap
+
+
+def fake_roadmap(prompt, generation_config):
+    rng = llm.fake_rng(prompt)
+    roadmap = {}
+    for week in range(1, llm.prompt_weeks(prompt) + 1):
+        roadmap[f"week {week}"] = {
+            "topic": f"Topic {week}",
+            "subtopics": [
+                {
+                    "subtopic": f"Subtopic {week}.{i}",
+                    "time": f"{rng.randint(1, 6)} hours",
+                    "description": f"Learn the key ideas of subtopic {week}.{i}",
+                }
+                for i in range(1, rng.randint(3, 5) + 1)
+            ],
+        }
+    return json.dumps(roadmap)
+
+
+llm.register_fake("roadmap", fake_roadmap)
+
+
+def fake_roadmap_outline(prompt, generation_config):
+    return json.dumps(
         {
-            "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-    ]
-
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        safety_settings=safety_settings,
-        generation_config=generation_config,
-        system_instruction='You are an AI agent who provides good personalized learning paths based on user input. You have to provide subtopics to learn with a small description of the subtopic telling what exactly to learn and how much time each subtopic will take. Give more time to subtopics that require more understanding.\nExample output:\n{\n  "week 1": {\n    "topic":"Introduction to Python",\n    "subtopics":[\n      {\n        "subtopic":"Getting Started with Python",\n        "time":"10 minute",\n        "description":"Learn Hello world in python"\n      },\n      {\n        "subtopic":"Data types in Python",\n        "time":"1 hour",\n        "description":"Learn about int, string, boolean, array, dict and casting data types"\n      },\n     {\n        "subtopic":"Conditionals in Python",\n        "time":"30 minutes",\n        "description":"Learn about comparison operators, if elif else statements"\n      },\n      {\n        "subtopic":"Loops",\n        "time":"30 minutes",\n        "description":"Learn about for loop, while loop, continue and break"\n      },\n      {\n        "subtopic":"OOPs in Python",\n        "time":"4 hours",\n        "description":"Learn about classes, objects, inheritance, polymorphism and OOPs concepts"\n      },\n    ]\n  }\n}',
+            f"week {week}": {"topic": f"Topic {week}", "focus": f"Key ideas of topic {week}"}
+            for week in range(1, llm.prompt_weeks(prompt) + 1)
+        }
     )
 
-    chat_session = model.start_chat(history=[])
 
-    response = chat_session.send_message(
-        f"Suggest a roadmap for learning {topic} in {time}. My Knowledge level is {knowledge_level}. I can spend total of 16 hours every week.",
-        stream=False,
-    )
-    print(response.text)
-    return json.loads(response.text)
+def fake_roadmap_week(prompt, generation_config):
+    week = re.search(r"Detail week (\d+)", prompt).group(1)
+    full = json.loads(fake_roadmap(f"1 week {prompt}", generation_config))
+    return json.dumps({"topic": f"Topic {week}", "subtopics": full["week 1"]["subtopics"]})
+
+
+llm.register_fake("roadmap-outline", fake_roadmap_outline)
+llm.register_fake("roadmap-week", fake_roadmap_week)
@@ -0,0 +1,409 @@
+# semantic_cache py
+"""
+Near-duplicate lookup for the generation endpoints.
+
+The response cache only matches requests whose normalized fields are
+identical, so "machine learning", "Machine Learning basics" and "intro to ML"
+each trigger their own generation. This index keeps a vector for every
+generated roadmap and quiz request and, on an exact-key miss, serves the
+stored result of the most similar earlier request if its similarity is at
+least SEMANTIC_CACHE_THRESHOLD.
+
+Vectors are built locally with a hashing vectorizer: words, their character
+trigrams and pairs of adjacent words (so word order counts), plus acronyms
+(words written in capitals, "ML") and the initials of consecutive words
+("machine learning" -> "ml") in a separate namespace, are hashed into a fixed
+number of signed dimensions per field. Filler words ("intro", "basics", ...)
+are dropped. An acronym is expanded into words only if it is defined in the
+same text ("Machine Learning (ML)") or listed in KNOWN_ACRONYMS, so a
+request's vector depends on its own text alone. Each field's vector is
+normalized and weighted, so the dot product of two request vectors is the
+weighted mean of the per-field cosine similarities. A match must also share
+at least one word (or expansion) with the request, so acronym and initials
+overlap alone never serves a result. Fields that change what is generated
+(roadmap duration and knowledge level, the course of a quiz) must match
+exactly. Candidates are found with one matrix-vector product over the
+requests with the same exact fields.
+
+Indexed requests are stored next to the responses in the response cache
+database, so every worker process sees them; entries whose response was
+evicted are dropped. GET /api/cache/stats reports lookups, hits and the
+upstream calls, estimated output tokens and generation seconds saved.
+
+Configuration (environment variables):
+
+- SEMANTIC_CACHE_ENABLED: "1" to enable the lookup (default "0")
+- SEMANTIC_CACHE_THRESHOLD: minimum similarity of a match (default 0.8)
+- SEMANTIC_CACHE_DIM: hashed dimensions per field (default 512)
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import threading
+
+import numpy as np
+
+import cache
+import llm
+
+
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.8"))
+SEMANTIC_CACHE_DIM = int(os.environ.get("SEMANTIC_CACHE_DIM", "512"))
+
+# endpoint -> (weight of each compared field, fields that must match exactly)
+ENDPOINT_FIELDS = {
+    "roadmap": ({"topic": 1.0}, ("time", "knowledge_level")),
+    # a quiz on the same subtopic of another course (Python vs JavaScript
+    # loops) is different content
+    "quiz": ({"topic": 0.2, "subtopic": 0.4, "description": 0.4}, ("course",)),
+}
+
+# compared after stemming
+FILLER_WORDS = frozenset(
+    "a an the and or of to for in on with about into my me i want learn how intro "
+    "introduction introductory basic fundamental beginner overview guide course "
+    "tutorial 101 essential primer".split()
+)
+# acronyms expanded without a definition in the request text
+KNOWN_ACRONYMS = {
+    "ai": "artificial intelligence",
+    "ml": "machine learning",
+    "dl": "deep learning",
+    "rl": "reinforcement learning",
+    "nlp": "natural language processing",
+    "llm": "large language models",
+    "cv": "computer vision",
+    "dsa": "data structures algorithms",
+    "oop": "object oriented programming",
+    "os": "operating systems",
+    "cn": "computer networks",
+    "dbms": "database management systems",
+}
+WORD_PATTERN = re.compile(r"[a-z0-9][a-z0-9+#]*")
+# in the raw text; "LLMs" is the acronym "llm"
+ACRONYM_PATTERN = re.compile(r"\b([A-Z]{2,6})s?\b")
+DEFINITION_PATTERN = re.compile(r"\(([A-Z]{2,6})s?\)")
+TRIGRAM_WEIGHT = 0.5
+BIGRAM_WEIGHT = 1.0
+MAX_INITIALS = 4
+
+
+def stem(token):
+    # plural "s" only, enough for "loops" and "loop" to match
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+def words(text):
+    tokens = [stem(t) for t in WORD_PATTERN.findall(cache.normalize(text or ""))]
+    content = [t for t in tokens if t not in FILLER_WORDS]
+    # a text made only of filler words keeps them, e.g. "Introduction"
+    return content or tokens
+
+
+def initialisms(tokens):
+    # initials of every run of 2..MAX_INITIALS consecutive words -> the words
+    result = {}
+    for size in range(2, MAX_INITIALS + 1):
+        for i in range(len(tokens) - size + 1):
+            run = tokens[i:i + size]
+            result["".join(t[0] for t in run)] = run
+    return result
+
+
+def definitions(text):
+    # acronyms the text defines: "Machine Learning (ML)" -> {"ml": ["machine", "learning"]}
+    result = {}
+    for match in DEFINITION_PATTERN.finditer(text):
+        acronym = match.group(1).lower()
+        before = words(text[:match.start()])[-len(acronym):]
+        if len(before) == len(acronym) and "".join(t[0] for t in before) == acronym:
+            result[acronym] = before
+    return result
+
+
+def analyse(text):
+    # (words, acronyms, expansions) of a field: its content words, the words
+    # written in capitals, and the words of those acronyms that are defined in
+    # the text or known
+    text = text or ""
+    tokens = words(text)
+    acronyms = sorted({a.lower() for a in ACRONYM_PATTERN.findall(text)})
+    defined = definitions(text)
+    expansions = []
+    for acronym in acronyms:
+        if acronym in defined:
+            expansions.extend(defined[acronym])
+        elif acronym in KNOWN_ACRONYMS:
+            expansions.extend(words(KNOWN_ACRONYMS[acronym]))
+    return tokens, acronyms, expansions
+
+
+def features(tokens, acronyms=(), expansions=()):
+    # (feature, weight) pairs of a field; acronyms and initials share the
+    # "a:" namespace, so "ML" and "machine learning" are similar but "go" and
+    # "graph optimization" are not
+    for token in list(tokens) + list(expansions):
+        yield "w:" + token, 1.0
+        padded = f"#{token}#"
+        for i in range(len(padded) - 2):
+            yield "c:" + padded[i:i + 3], TRIGRAM_WEIGHT
+    # word order, "learning machines" is not "machine learning"
+    for sequence in (tokens, expansions):
+        for first, second in zip(sequence, sequence[1:]):
+            yield f"b:{first} {second}", BIGRAM_WEIGHT
+    for initials in initialisms(tokens):
+        yield "a:" + initials, 1.0
+    for acronym in acronyms:
+        yield "a:" + acronym, 1.0
+
+
+def hash_vector(text, dim):
+    # normalized vector of a field's text and the set of its words and expansions
+    tokens, acronyms, expansions = analyse(text)
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, weight in features(tokens, acronyms, expansions):
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += weight if h & 0x80000000 else -weight
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector), set(tokens) | set(expansions)
+
+
+class _Partition:
+    # vectors of the indexed requests sharing the same exact fields
+    def __init__(self, width):
+        self.vectors = np.zeros((16, width), dtype=np.float32)
+        self.keys = []
+        self.rows = {}
+
+    def add(self, key, vector):
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == len(self.vectors):
+                self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+            self.keys.append(key)
+            self.rows[key] = row
+        self.vectors[row] = vector
+
+    def remove(self, key):
+        # the last row takes the removed row's place
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        last = len(self.keys) - 1
+        if row != last:
+            moved = self.keys[last]
+            self.vectors[row] = self.vectors[last]
+            self.keys[row] = moved
+            self.rows[moved] = row
+        self.keys.pop()
+
+    def nearest(self, vector, threshold):
+        # [(key, similarity)] of the requests at least threshold similar, most similar first
+        if not self.keys:
+            return []
+        similarities = self.vectors[:len(self.keys)] @ vector
+        rows = np.flatnonzero(similarities >= threshold)
+        rows = rows[np.argsort(-similarities[rows])]
+        return [(self.keys[row], float(similarities[row])) for row in rows]
+
+
+class SemanticIndex:
+    def __init__(self, response_cache, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 dim=SEMANTIC_CACHE_DIM, enabled=SEMANTIC_CACHE_ENABLED):
+        self.cache = response_cache
+        self.threshold = threshold
+        self.dim = dim
+        self.enabled = enabled
+        # (endpoint, exact fields) -> _Partition
+        self._partitions = {}
+        # key -> (endpoint, exact fields, tokens, seconds, words) of indexed requests
+        self._entries = {}
+        self._last_rowid = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if enabled:
+            self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = cache.connect(self.cache.path)
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS semantic_index (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                fields TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                seconds REAL NOT NULL,
+                created REAL NOT NULL
+            )"""
+        )
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS semantic_stats (
+                endpoint TEXT PRIMARY KEY,
+                lookups INTEGER NOT NULL DEFAULT 0,
+                hits INTEGER NOT NULL DEFAULT 0,
+                saved_tokens INTEGER NOT NULL DEFAULT 0,
+                saved_seconds REAL NOT NULL DEFAULT 0
+            )"""
+        )
+
+    def _count(self, endpoint, hit=False, tokens=0, seconds=0.0):
+        self._conn().execute(
+            "INSERT INTO semantic_stats (endpoint, lookups, hits, saved_tokens, saved_seconds) "
+            "VALUES (?, 1, ?, ?, ?) ON CONFLICT(endpoint) DO UPDATE SET "
+            "lookups = lookups + 1, hits = hits + excluded.hits, "
+            "saved_tokens = saved_tokens + excluded.saved_tokens, "
+            "saved_seconds = saved_seconds + excluded.saved_seconds",
+            (endpoint, int(hit), tokens, seconds),
+        )
+
+    def _exact(self, endpoint, fields):
+        _, exact = ENDPOINT_FIELDS[endpoint]
+        return json.dumps([cache.normalize(fields.get(name)) for name in exact])
+
+    def _vector(self, endpoint, fields):
+        # (request vector, words and expansions of all compared fields)
+        weights, _ = ENDPOINT_FIELDS[endpoint]
+        parts = []
+        all_words = set()
+        for name, weight in weights.items():
+            vector, field_words = hash_vector(fields.get(name), self.dim)
+            parts.append(vector * np.sqrt(weight))
+            all_words |= field_words
+        return np.concatenate(parts), all_words
+
+    def _insert(self, key, endpoint, fields, tokens, seconds):
+        # in-memory part of add(), also used for rows added by other processes
+        exact = self._exact(endpoint, fields)
+        partition = self._partitions.get((endpoint, exact))
+        if partition is None:
+            width = self.dim * len(ENDPOINT_FIELDS[endpoint][0])
+            partition = self._partitions[(endpoint, exact)] = _Partition(width)
+        vector, request_words = self._vector(endpoint, fields)
+        partition.add(key, vector)
+        self._entries[key] = (endpoint, exact, tokens, seconds, request_words)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._partitions[(entry[0], entry[1])].remove(key)
+
+    def _refresh(self):
+        # picks up requests indexed since the last call, by any process
+        rows = self._conn().execute(
+            "SELECT rowid, key, endpoint, fields, tokens, seconds FROM semantic_index "
+            "WHERE rowid > ? ORDER BY rowid",
+            (self._last_rowid,),
+        ).fetchall()
+        for rowid, key, endpoint, fields, tokens, seconds in rows:
+            if endpoint in ENDPOINT_FIELDS:
+                self._insert(key, endpoint, json.loads(fields), tokens, seconds)
+            self._last_rowid = rowid
+
+    def add(self, endpoint, fields, value, seconds):
+        # indexes a request after its result was generated in `seconds` and
+        # stored in the response cache
+        if not self.enabled or endpoint not in ENDPOINT_FIELDS:
+            return
+        key = cache.make_key(endpoint, fields)
+        tokens = llm.estimate_tokens(json.dumps(value))
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO semantic_index (key, endpoint, fields, tokens, seconds, created) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, endpoint, json.dumps(fields), tokens, seconds, time.time()),
+        )
+        conn.execute("DELETE FROM semantic_index WHERE key NOT IN (SELECT key FROM responses)")
+        with self._lock:
+            self._refresh()
+
+    def lookup(self, endpoint, fields):
+        # the stored result of the most similar earlier request, or None
+        if not self.enabled or endpoint not in ENDPOINT_FIELDS:
+            return None
+        exact_key = cache.make_key(endpoint, fields)
+        vector, request_words = self._vector(endpoint, fields)
+        with self._lock:
+            self._refresh()
+            partition = self._partitions.get((endpoint, self._exact(endpoint, fields)))
+            candidates = [] if partition is None else [
+                (key, similarity, self._entries[key])
+                for key, similarity in partition.nearest(vector, self.threshold)
+                if key != exact_key and self._entries[key][4] & request_words
+            ]
+        for key, similarity, (_, _, tokens, seconds, _) in candidates:
+            value = self.cache.peek(key, time.time() - self.cache.ttl)
+            if value is not None:
+                self._count(endpoint, hit=True, tokens=tokens, seconds=seconds)
+                print(f"semantic cache hit for {endpoint} (similarity {similarity:.2f})")
+                return value
+            # the response was evicted, try the next nearest request
+            with self._lock:
+                self._drop(key)
+        self._count(endpoint)
+        return None
+
+    def get_or_create(self, flight, endpoint, fields, generate, fresh=False):
+        # flight.get_or_create with a similarity lookup between the exact-key
+        # lookup and the generation
+        if not self.enabled or fresh or endpoint not in ENDPOINT_FIELDS:
+            return flight.get_or_create(endpoint, fields, generate, fresh=fresh)
+        key = cache.make_key(endpoint, fields)
+        since = time.time()
+        value = flight.cache.get(key, endpoint)
+        if value is not None:
+            return value
+        value = self.lookup(endpoint, fields)
+        if value is not None:
+            return value
+
+        timing = {}
+
+        def timed_generate():
+            started = time.perf_counter()
+            result = generate()
+            timing["seconds"] = time.perf_counter() - started
+            return result
+
+        value = flight.do(key, endpoint, timed_generate, since)
+        # only the caller that ran the generation indexes it
+        if "seconds" in timing:
+            self.add(endpoint, fields, value, timing["seconds"])
+        return value
+
+    def stats(self):
+        if not self.enabled:
+            return {"enabled": False}
+        endpoints = {}
+        for endpoint, lookups, hits, saved_tokens, saved_seconds in self._conn().execute(
+            "SELECT endpoint, lookups, hits, saved_tokens, saved_seconds FROM semantic_stats"
+        ):
+            endpoints[endpoint] = {
+                "lookups": lookups,
+                "hits": hits,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "saved_calls": hits,
+                "saved_output_tokens": saved_tokens,
+                "saved_seconds": saved_seconds,
+            }
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "enabled": True,
+            "threshold": self.threshold,
+            "entries": entries,
+            "endpoints": endpoints,
+        }
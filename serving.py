@@ -0,0 +1,185 @@
+# serving py
+"""
+Production serving mode for the Flask API.
+
+AdmissionControl is a WSGI middleware that caps the number of requests being
+handled at once, keeps a bounded queue of waiting requests and answers 503
+straight away once that queue is full, so a burst of users gets a fast
+"try again" instead of piling up behind slow Gemini calls. Queued requests
+wait inside the middleware, so the server needs a thread for every active
+and every queued request, plus a few that answer the 503s (server_threads());
+with fewer, requests would wait in the server's own unbounded task queue
+and never reach the middleware. serve() runs the API on waitress with that
+many threads and drains in-flight requests on SIGINT/SIGTERM before exiting.
+
+Configuration (environment variables):
+
+- HOST / PORT: bind address (default 0.0.0.0:5001)
+- SERVER_THREADS: requests handled at once per process (default 16)
+- SERVER_MAX_ACTIVE: overrides SERVER_THREADS
+- SERVER_MAX_QUEUE: requests allowed to wait for a slot (default 64)
+- SERVER_QUEUE_TIMEOUT: seconds a request may wait before a 503 (default 30)
+- SERVER_SHUTDOWN_GRACE: seconds to let in-flight requests finish on shutdown (default 30)
+
+Multiple worker processes are run with gunicorn (see gunicorn.conf.py).
+"""
+
+import os
+import time
+import signal
+import threading
+
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "5001"))
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "16"))
+SERVER_MAX_ACTIVE = int(os.environ.get("SERVER_MAX_ACTIVE", str(SERVER_THREADS)))
+SERVER_MAX_QUEUE = int(os.environ.get("SERVER_MAX_QUEUE", "64"))
+SERVER_QUEUE_TIMEOUT = float(os.environ.get("SERVER_QUEUE_TIMEOUT", "30"))
+SERVER_SHUTDOWN_GRACE = float(os.environ.get("SERVER_SHUTDOWN_GRACE", "30"))
+# threads beyond active + queued requests, they only answer 503s
+REJECT_THREADS = 4
+
+
+def server_threads(max_active=SERVER_MAX_ACTIVE, max_queue=SERVER_MAX_QUEUE):
+    return max_active + max_queue + REJECT_THREADS
+
+
+def _unavailable(start_response, reason):
+    body = f"Server busy: {reason}".encode("utf-8")
+    start_response(
+        "503 Service Unavailable",
+        [
+            ("Content-Type", "text/plain"),
+            ("Content-Length", str(len(body))),
+            ("Retry-After", "1"),
+        ],
+    )
+    return [body]
+
+
+class _ReleasingIterable:
+    # keeps the slot held until a (possibly streamed) response is fully sent
+    def __init__(self, iterable, release):
+        self._iterable = iterable
+        self._release = release
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        try:
+            if hasattr(self._iterable, "close"):
+                self._iterable.close()
+        finally:
+            self._release()
+
+
+class AdmissionControl:
+    def __init__(self, app, max_active=SERVER_MAX_ACTIVE, max_queue=SERVER_MAX_QUEUE,
+                 queue_timeout=SERVER_QUEUE_TIMEOUT):
+        self.app = app
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self.draining = False
+        self._cond = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._cond:
+            if self.draining:
+                self.rejected += 1
+                return _unavailable(start_response, "shutting down")
+            if self.active >= self.max_active and self.queued >= self.max_queue:
+                self.rejected += 1
+                return _unavailable(start_response, "queue full")
+            self.queued += 1
+            deadline = time.monotonic() + self.queue_timeout
+            while self.active >= self.max_active:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.draining:
+                    self.queued -= 1
+                    self.rejected += 1
+                    return _unavailable(start_response, "timed out waiting for a slot")
+                self._cond.wait(remaining)
+            self.queued -= 1
+            self.active += 1
+
+        released = False
+
+        def release():
+            nonlocal released
+            with self._cond:
+                if not released:
+                    released = True
+                    self.active -= 1
+                    self._cond.notify_all()
+
+        try:
+            return _ReleasingIterable(self.app(environ, start_response), release)
+        except BaseException:
+            release()
+            raise
+
+    def drain(self, timeout=SERVER_SHUTDOWN_GRACE):
+        # stop admitting requests and wait for the in-flight ones to finish
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.draining = True
+            self._cond.notify_all()
+            while self.active or self.queued:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": self.active,
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "max_active": self.max_active,
+                "max_queue": self.max_queue,
+                "draining": self.draining,
+            }
+
+
+def serve(app, admission, host=HOST, port=PORT):
+    from waitress.server import create_server
+
+    threads = server_threads(admission.max_active, admission.max_queue)
+    server = create_server(
+        app,
+        host=host,
+        port=port,
+        threads=threads,
+        # connections beyond what the queue can take are answered with 503 by
+        # AdmissionControl, not left waiting in the socket backlog
+        connection_limit=threads + 100,
+    )
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    runner = threading.Thread(target=server.run, daemon=True)
+    runner.start()
+    print(f"Serving on http://{host}:{port} with {threads} threads "
+          f"({admission.max_active} active, {admission.max_queue} queued)")
+    while not stop.wait(0.5):
+        if not runner.is_alive():
+            return
+
+    print("Shutting down, draining in-flight requests...")
+    if not admission.drain():
+        print("Shutdown grace period expired with requests still in flight")
+    server.close()
+    server.task_dispatcher.shutdown()
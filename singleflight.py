@@ -0,0 +1,262 @@
+# singleflight py
+"""
+Coalesces identical in-flight generation requests.
+
+Concurrent callers asking for the same cache key wait on one upstream call
+and all receive its result. Within a process the waiters share a threading
+event; across processes a lease row in the response cache database marks the
+key as being generated, and other processes poll the cache for the leader's
+result instead of starting their own call. Streamed generations lead the
+same way (stream()): the leader passes chunks on as they arrive, followers
+replay the stored result once it is complete.
+"""
+
+import os
+import time
+import socket
+import threading
+
+import cache
+
+
+SINGLEFLIGHT_LEASE_TTL = float(os.environ.get("SINGLEFLIGHT_LEASE_TTL", "180"))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.environ.get("SINGLEFLIGHT_POLL_INTERVAL", "0.2"))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        # the leader ran to the end, even if it produced no value
+        self.complete = False
+
+
+class SingleFlight:
+    def __init__(self, response_cache, lease_ttl=SINGLEFLIGHT_LEASE_TTL,
+                 poll_interval=SINGLEFLIGHT_POLL_INTERVAL):
+        self.cache = response_cache
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = cache.connect(self.cache.path)
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS inflight (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires REAL NOT NULL
+            )"""
+        )
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS singleflight_stats (
+                endpoint TEXT PRIMARY KEY,
+                upstream_calls INTEGER NOT NULL DEFAULT 0,
+                saved_calls INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+
+    def _count(self, endpoint, column):
+        self._conn().execute(
+            f"INSERT INTO singleflight_stats (endpoint, {column}) VALUES (?, 1) "
+            f"ON CONFLICT(endpoint) DO UPDATE SET {column} = {column} + 1",
+            (endpoint,),
+        )
+
+    def _acquire(self, key):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM inflight WHERE key = ? AND expires < ?", (key, now))
+            conn.execute(
+                "INSERT OR IGNORE INTO inflight (key, owner, expires) VALUES (?, ?, ?)",
+                (key, self.owner, now + self.lease_ttl),
+            )
+            acquired = conn.execute("SELECT changes()").fetchone()[0] == 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return acquired
+
+    def _release(self, key):
+        self._conn().execute(
+            "DELETE FROM inflight WHERE key = ? AND owner = ?", (key, self.owner)
+        )
+
+    def _leased(self, key):
+        row = self._conn().execute(
+            "SELECT 1 FROM inflight WHERE key = ? AND expires >= ?", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def _wait_remote(self, key, since):
+        # another process holds the lease; wait for its result to land in the cache
+        while True:
+            value = self.cache.peek(key, since)
+            if value is not None:
+                return value
+            if not self._leased(key):
+                return self.cache.peek(key, since)
+            time.sleep(self.poll_interval)
+
+    def _stored(self, key, since):
+        # a result stored since the caller's cache miss, checked after taking
+        # the lease in case another process finished in between
+        value = self.cache.peek(key, since)
+        if value is not None:
+            self._release(key)
+        return value
+
+    def _lead(self, key, endpoint, generate, since):
+        while True:
+            if self._acquire(key):
+                value = self._stored(key, since)
+                if value is not None:
+                    self._count(endpoint, "saved_calls")
+                    return value
+                try:
+                    value = generate()
+                    self.cache.set(key, endpoint, value)
+                finally:
+                    self._release(key)
+                self._count(endpoint, "upstream_calls")
+                return value
+            value = self._wait_remote(key, since)
+            if value is not None:
+                self._count(endpoint, "saved_calls")
+                return value
+            # the other process gave up without a result, try to take over
+
+    def _join(self, key):
+        # (call, True) for the caller that leads the in-process call
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                return call, True
+            return call, False
+
+    def _finish(self, key, call):
+        with self._lock:
+            del self._calls[key]
+        call.done.set()
+
+    def do(self, key, endpoint, generate, since=None):
+        # since: time of the caller's cache miss, results stored after it are used
+        since = time.time() if since is None else since
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            if call.complete:
+                self._count(endpoint, "saved_calls")
+                return call.value
+            # a streaming leader's client went away before the end, take over
+
+        try:
+            call.value = self._lead(key, endpoint, generate, since)
+            call.complete = True
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+
+    def stream(self, key, endpoint, chunks, collect, replay, stored=None, since=None):
+        # streaming variant of do(): the leader yields the chunks of chunks()
+        # as they arrive, stores collect(all chunks) unless it is None and
+        # calls stored(value, seconds); followers wait for the stored value
+        # and yield replay(value), or nothing when the leader's stream
+        # completed without one
+        since = time.time() if since is None else since
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            if call.complete:
+                self._count(endpoint, "saved_calls")
+                if call.value is not None:
+                    yield from replay(call.value)
+                return
+
+        try:
+            while True:
+                if self._acquire(key):
+                    value = self._stored(key, since)
+                    if value is None:
+                        break
+                else:
+                    value = self._wait_remote(key, since)
+                    if value is None:
+                        continue
+                self._count(endpoint, "saved_calls")
+                call.value = value
+                call.complete = True
+                yield from replay(value)
+                return
+            started = time.perf_counter()
+            upstream = chunks()
+            try:
+                items = []
+                for item in upstream:
+                    items.append(item)
+                    yield item
+                value = collect(items)
+                if value is not None:
+                    self.cache.set(key, endpoint, value)
+            finally:
+                if hasattr(upstream, "close"):
+                    upstream.close()
+                self._release(key)
+            self._count(endpoint, "upstream_calls")
+            call.value = value
+            call.complete = True
+            if value is not None and stored is not None:
+                stored(value, time.perf_counter() - started)
+        except GeneratorExit:
+            # the client went away, followers take over
+            raise
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+
+    def get_or_create(self, endpoint, fields, generate, fresh=False):
+        # same contract as ResponseCache.get_or_create, with misses coalesced
+        key = cache.make_key(endpoint, fields)
+        since = time.time()
+        if not fresh:
+            value = self.cache.get(key, endpoint)
+            if value is not None:
+                return value
+        return self.do(key, endpoint, generate, since)
+
+    def stats(self):
+        return {
+            endpoint: {"upstream_calls": upstream_calls, "saved_calls": saved_calls}
+            for endpoint, upstream_calls, saved_calls in self._conn().execute(
+                "SELECT endpoint, upstream_calls, saved_calls FROM singleflight_stats"
+            )
+        }
@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import threading
+
+# Load-time bookkeeping for the vision models. The dlib and emotion models are
+# only loaded when the Engagement Monitor is first used; with VISION_WARMUP=1
+# they are loaded in a background thread as soon as the Streamlit server runs
+# the app for the first time, and one dummy frame is pushed through each so
+# the first real frame doesn't pay for it. Startup, model load, warm-up and
+# first-frame latencies are collected here and shown on the Engagement Monitor.
+VISION_WARMUP = os.environ.get("VISION_WARMUP", "0") == "1"
+WARMUP_FRAME_SIZE = (480, 640)
+
+_timings = {}
+_lock = threading.Lock()
+_state = "idle"
+_thread = None
+
+
+def record(name, seconds):
+    with _lock:
+        _timings[name] = seconds
+
+
+def record_once(name, seconds):
+    # keeps the first measurement, e.g. the cold start of the process
+    with _lock:
+        _timings.setdefault(name, seconds)
+
+
+def _warm_up():
+    global _state
+    import numpy as np
+
+    started = time.perf_counter()
+    try:
+        import dlib
+        import face_analysis
+        import emotion_service
+        from eyeTracking import EYE_PROCESS_POOL
+
+        frame = np.zeros(WARMUP_FRAME_SIZE + (3,), dtype=np.uint8)
+        if EYE_PROCESS_POOL:
+            # starts the workers, each loads the dlib models in its initializer
+            import frame_pool
+            frame_pool.get_pool().analyse(frame, None, 1.0, 0.5)
+        else:
+            face_analysis.load_models()
+            gray = frame[..., 0]
+            face_analysis.locate_faces(gray, [dlib.rectangle(0, 0, 100, 100)])
+        record("dlib_warmup", time.perf_counter() - started)
+
+        emotion_started = time.perf_counter()
+        crop = frame[:100, :100]
+        if emotion_service.EMOTION_BATCHING:
+            emotion_service.get_service().infer(crop).result(timeout=300)
+        else:
+            from deepface import DeepFace
+            DeepFace.analyze(crop, actions=["emotion"], enforce_detection=False,
+                             detector_backend="skip")
+        record("emotion_warmup", time.perf_counter() - emotion_started)
+        record("warmup", time.perf_counter() - started)
+        state = "done"
+    except Exception as e:
+        print(f"Vision warm-up failed: {e}")
+        state = "failed"
+    with _lock:
+        _state = state
+    print(f"Vision warm-up {state} in {time.perf_counter() - started:.1f}s")
+
+
+def start():
+    # idempotent, safe to call on every Streamlit rerun
+    global _state, _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _state = "running"
+        _thread = threading.Thread(target=_warm_up, name="vision-warmup", daemon=True)
+    _thread.start()
+
+
+def status():
+    # {"warmup": state, "timings": {name: seconds}}, including the models'
+    # load times in this process
+    timings = dict(_timings)
+    # only looked up, status() must not import the vision modules itself
+    face_analysis = sys.modules.get("face_analysis")
+    if face_analysis is not None and face_analysis.model_load_time is not None:
+        timings["dlib_load"] = face_analysis.model_load_time
+    emotion_service = sys.modules.get("emotion_service")
+    service = emotion_service.loaded_service() if emotion_service is not None else None
+    if service is not None and service.model_load_time is not None:
+        timings["emotion_model_load"] = service.model_load_time
+    with _lock:
+        return {"warmup": _state, "timings": timings}